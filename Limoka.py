@@ -1,17 +1,29 @@
 # meta developer: @limokanews
 # requires: whoosh
 
-from whoosh.index import create_in, open_dir
-from whoosh.fields import Schema, TEXT, ID
-from whoosh.qparser import QueryParser, OrGroup
-from whoosh.query import FuzzyTerm, Wildcard
+from whoosh.index import create_in, open_dir, exists_in
+from whoosh.fields import Schema, TEXT, ID, KEYWORD, NGRAMWORDS, STORED
+from whoosh.qparser import MultifieldParser, OrGroup, WildcardPlugin
+from whoosh.query import FuzzyTerm, Prefix, Term, And, Or
 
 import aiohttp
 import random
 import logging
 import os
+import io
 import html
 import json
+import gzip
+import tarfile
+import hashlib
+import shutil
+import time
+import secrets
+import functools
+import threading
+import contextlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import asyncio
 
@@ -30,35 +42,570 @@ logger = logging.getLogger("Limoka")
 __version__ = (1, 1, 0)
 
 
+# Fields searched by default, the boosts live in the schema (see Indexer)
+SEARCH_FIELDS = ["name", "description", "commands", "command_docs", "category", "developer"]
+PREFIX_FIELDS = ["name", "commands"]
+FUZZY_FIELDS = ["name", "commands", "description"]
+
+# Match tiers are OR'ed into one query, so a module matching exactly
+# also collects the prefix, substring and fuzzy scores and stays on top
+EXACT_BOOST = 4.0
+PREFIX_BOOST = 2.0
+SUBSTRING_BOOST = 1.5
+FUZZY_BOOST = 1.0
+
+SEARCH_LIMIT = 10
+# Dropped from queries, see Search.build_query
+WILDCARDS = str.maketrans("", "", "*?")
+# Hits scoring below this share of the best hit are noise (stray fuzzy or ngram matches)
+MIN_SCORE_RATIO = 0.1
+
+# Result pages are kept server side, callbacks only carry a session id and an index
+SESSION_TTL = 30 * 60
+SESSION_LIMIT = 128
+
+# Banner/pic checks are remembered in the db, broken links for a shorter time
+URL_CACHE_TTL = 24 * 60 * 60
+URL_CACHE_NEGATIVE_TTL = 60 * 60
+URL_PREWARM_CONCURRENCY = 8
+
+# Shared HTTP session, see Limoka._create_session
+HTTP_LIMIT = 32
+HTTP_LIMIT_PER_HOST = 8
+HTTP_KEEPALIVE = 60
+HTTP_DNS_CACHE_TTL = 300
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=10)
+URL_CHECK_TIMEOUT = aiohttp.ClientTimeout(total=5)
+
+INDEX_DIR = "limoka_search"
+CATALOG_CACHE = os.path.join(INDEX_DIR, "catalog.json")
+CATALOG_REFRESH_INTERVAL = 60 * 60
+# Preferred first, modules.json is the fallback for mirrors without the compact file
+CATALOG_FILES = ("modules.compact.json.gz", "modules.json")
+DELTA_FILE = "modules.delta.json.gz"
+# Published by categories.py separately, so reclassifying doesn't change the catalog
+CATEGORIES_FILE = "categories.json"
+CATEGORIES_CACHE = os.path.join(INDEX_DIR, "categories.json")
+SIMILAR_FILE = "similar.json"
+SIMILAR_CACHE = os.path.join(INDEX_DIR, "similar.json")
+COMPACT_FORMAT = 1
+# Published by build_index.py, bump INDEX_FORMAT whenever Indexer changes
+# the documents it writes so clients stop using old prebuilt indexes
+INDEX_MANIFEST = "search_index.json"
+INDEX_FORMAT = 2
+
+# Whoosh is synchronous, searches and commits run in these threads
+SEARCH_WORKERS = 2
+
+# Timings kept per stage for .limokastats, histogram bucket bounds in ms
+STATS_SAMPLES = 512
+STATS_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def expand_catalog(compact):
+    """Rebuilds the modules.json structure from modules.compact.json.gz (see catalog.py)"""
+    if compact.get("format") != COMPACT_FORMAT:
+        raise ValueError(f"Unsupported compact catalog format: {compact.get('format')}")
+
+    rows = compact["commands"]
+    modules = {}
+    for path, data in compact["modules"].items():
+        if "command_ids" not in data:
+            modules[path] = data
+            continue
+
+        module = {key: value for key, value in data.items() if key != "command_ids"}
+        module["commands"], module["new_commands"] = [], []
+        for command_id in data["command_ids"]:
+            name, doc, ru_doc, en_doc = rows[command_id]
+            module["commands"].append({name: " ".join(filter(None, (doc, ru_doc, en_doc)))})
+            module["new_commands"].append(
+                {name.replace("cmd", ""): {"ru_doc": ru_doc, "en_doc": en_doc, "doc": doc}}
+            )
+        modules[path] = module
+    return modules
+
+
+def apply_delta(modules, delta):
+    """Applies a modules.delta.json manifest published by parse.py"""
+    modules = dict(modules)
+    for path in delta["removed"]:
+        modules.pop(path, None)
+    modules.update(delta["added"])
+    modules.update(delta["changed"])
+    return modules
+
+
+def apply_categories(modules, categories):
+    """Adds categories from categories.json to the catalog modules"""
+    return {
+        path: {**data, "category": categories[path]} if path in categories else data
+        for path, data in modules.items()
+    }
+
+
 class Search:
-    def __init__(self, query, ix):
-        self.schema = Schema(
-            title=TEXT(stored=True), 
-            path=ID(stored=True), 
-            content=TEXT(stored=True)
-        )
+    def __init__(self, query, ix, stats=None, popularity=None):
         self.query = query
         self.ix = ix
+        self.stats = stats or Stats()
+        # {path: times opened}, breaks ties between equally scored modules
+        self.popularity = popularity or {}
+
+    def build_query(self):
+        """Builds a single scored query covering exact, prefix, substring and fuzzy matches"""
+        schema = self.ix.schema
+        # "*" and "?" from the user would become wildcard scans over every
+        # field, prefixes and typos are covered by the tiers below
+        text = self.query.translate(WILDCARDS)
+        words = list(schema["name"].process_text(text, mode="query"))
+        parser = MultifieldParser(SEARCH_FIELDS, schema, group=OrGroup.factory(0.8))
+        parser.remove_plugin_class(WildcardPlugin)
+
+        substrings = []
+        for word in words:
+            grams = list(schema["ngrams"].process_text(word, mode="query"))
+            if grams:
+                substrings.append(And([Term("ngrams", gram) for gram in grams]))
+
+        return Or(
+            [
+                parser.parse(text).with_boost(EXACT_BOOST),
+                Or(
+                    [Prefix(field, word) for field in PREFIX_FIELDS for word in words]
+                ).with_boost(PREFIX_BOOST),
+                Or(substrings).with_boost(SUBSTRING_BOOST),
+                Or(
+                    [
+                        FuzzyTerm(field, word, maxdist=1 if len(word) < 5 else 2, prefixlength=1)
+                        for field in FUZZY_FIELDS
+                        for word in words
+                    ]
+                ).with_boost(FUZZY_BOOST),
+            ]
+        )
+
+    def search_module(self, categories=None, hide_critical=False, limit=SEARCH_LIMIT):
+        """Returns the top `limit` modules as [(path, score)], best first.
+
+        Hits below MIN_SCORE_RATIO of the best score are dropped. Equal scores
+        are ordered by popularity, then by path, so the order is stable.
+        """
+        with self.stats.measure("query_parse"):
+            query = self.build_query()
+            category_filter = (
+                Or([Term("category", category.lower()) for category in categories])
+                if categories
+                else None
+            )
+
+        with self.stats.measure("index_search"), self.ix.searcher() as searcher:
+            # Every hit is scored anyway, limit=None only skips Whoosh's own
+            # cut, which would split equal scores by document number
+            results = searcher.search(
+                query,
+                limit=None,
+                filter=category_filter,
+                mask=Term("risk", "critical") if hide_critical else None,
+            )
+            if not results:
+                return []
+
+            scored = sorted(results.top_n, key=lambda hit: -hit[0])
+            threshold = scored[0][0] * MIN_SCORE_RATIO
+            if len(scored) > limit:
+                # Keep everything tied with the last hit that makes the cut
+                threshold = max(threshold, scored[limit - 1][0])
+            hits = [
+                (searcher.stored_fields(docnum)["path"], score)
+                for score, docnum in scored
+                if score >= threshold
+            ]
+            hits.sort(key=lambda hit: (-hit[1], -self.popularity.get(hit[0], 0), hit[0]))
+            return hits[:limit]
+
+
+class Indexer:
+    """Keeps the Whoosh index in sync with the modules catalog.
 
-    def search_module(self, content=None):
+    Every document stores a fingerprint of the module it was built from,
+    so only modules whose data actually changed are reindexed.
+    """
+
+    def __init__(self, dirname):
+        self.schema = Schema(
+            path=ID(stored=True, unique=True),
+            name=TEXT(stored=True, field_boost=4.0),
+            description=TEXT(field_boost=2.0),
+            commands=TEXT(field_boost=3.0),
+            command_docs=TEXT(),
+            category=KEYWORD(commas=True, lowercase=True, scorable=True),
+            risk=KEYWORD(commas=True),
+            developer=TEXT(field_boost=0.5),
+            ngrams=NGRAMWORDS(minsize=3, maxsize=8),
+            fingerprint=STORED,
+        )
+        os.makedirs(dirname, exist_ok=True)
+        self.ix = open_dir(dirname) if exists_in(dirname) else None
+        if self.ix is not None and self.ix.schema != self.schema:
+            self.ix.close()
+            self.ix = None
+        if self.ix is None:
+            self.ix = create_in(dirname, self.schema)
+
+    @staticmethod
+    def fingerprint(module_data):
+        data = json.dumps(module_data, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(f"{INDEX_FORMAT}:{data}".encode()).hexdigest()
+
+    def indexed(self):
+        """Returns {path: fingerprint} for every module in the index"""
         with self.ix.searcher() as searcher:
-            parser = QueryParser("content", self.ix.schema, group=OrGroup.factory(0.8))
-            query = parser.parse(self.query)
-            wildcard_query = Wildcard("content", f"*{self.query}*")
-            fuzzy_query = FuzzyTerm("content", self.query, maxdist=2, prefixlength=1)
+            return {
+                fields["path"]: fields.get("fingerprint")
+                for fields in searcher.all_stored_fields()
+            }
+
+    def update(self, modules):
+        """Reindexes changed modules and drops removed ones.
+
+        Returns True if the index was modified.
+        """
+        indexed = self.indexed()
+        fingerprints = {
+            path: self.fingerprint(module_data)
+            for path, module_data in modules.items()
+        }
+        changed = [path for path, fp in fingerprints.items() if indexed.get(path) != fp]
+        removed = [path for path in indexed if path not in fingerprints]
+
+        if not changed and not removed:
+            return False
+
+        writer = self.ix.writer()
+        for path in removed:
+            writer.delete_by_term("path", path)
+        for path in changed:
+            writer.update_document(**self._document(path, modules[path], fingerprints[path]))
+        writer.commit()
+
+        logger.debug(
+            "Index updated: %d changed, %d removed", len(changed), len(removed)
+        )
+        return True
+
+    @staticmethod
+    def _document(module_path, module_data, fingerprint):
+        """Builds the single index document of a module"""
+        commands, command_docs = [], []
+        for func in module_data["commands"]:
+            for command, description in func.items():
+                commands.append(command.replace("cmd", ""))
+                if description:
+                    command_docs.append(description)
+
+        return {
+            "path": module_path,
+            "name": module_data["name"],
+            "description": module_data["description"] or "",
+            "commands": " ".join(commands),
+            "command_docs": "\n".join(command_docs),
+            "category": ",".join(module_data.get("category", [])),
+            # Levels with hits from the parse.py risk scan, used to mask modules
+            "risk": ",".join(level for level, hits in module_data.get("risk", {}).items() if hits),
+            "developer": module_data["meta"].get("developer") or "",
+            "ngrams": " ".join([module_data["name"], *commands]),
+            "fingerprint": fingerprint,
+        }
+
+
+class QueryCache:
+    """LRU cache of query -> ranked module paths with a TTL"""
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, query):
+        item = self._data.get(query)
+        if item is None:
+            return None
+
+        expires, paths = item
+        if expires < time.monotonic():
+            del self._data[query]
+            return None
+
+        self._data.move_to_end(query)
+        return paths
+
+    def set(self, query, paths):
+        self._data[query] = (time.monotonic() + self.ttl, paths)
+        self._data.move_to_end(query)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
+class ResultSession:
+    """Ranked results of one search, fetched a page at a time as the user scrolls.
+
+    Sessions made from a fixed list of paths (similar modules) are never extended.
+    """
+
+    def __init__(self, query, filters=None, paths=None):
+        self.query = query
+        self.filters = filters or {}
+        # Filters being edited in the filter menu, applied on "Apply"
+        self.draft = {}
+        self.searchable = paths is None
+        self.paths = paths or []
+        self.exhausted = not self.searchable
+        # Paths whose open was already counted, paging back to them is not a new open
+        self.opened = set()
+
+    def reset(self, filters):
+        self.filters = filters
+        self.paths = []
+        self.exhausted = False
+        self.opened = set()
+
+    def extend(self, paths, limit):
+        """Adds the first limit paths of a deeper search, keeping the pages already shown in place.
+
+        The search is expected to ask for one path more, to know if there is another page.
+        """
+        seen = set(self.paths)
+        self.paths += [path for path in paths[:limit] if path not in seen]
+        self.exhausted = len(paths) <= limit
+
+
+class ResultSessions:
+    """Result sessions by short id, dropped SESSION_TTL after their last use"""
+
+    def __init__(self, maxsize=SESSION_LIMIT, ttl=SESSION_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def create(self, session):
+        sid = secrets.token_urlsafe(6)
+        while sid in self._data:
+            sid = secrets.token_urlsafe(6)
+        self._data[sid] = (time.monotonic() + self.ttl, session)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return sid
+
+    def get(self, sid):
+        item = self._data.get(sid)
+        if item is None:
+            return None
+
+        expires, session = item
+        if expires < time.monotonic():
+            del self._data[sid]
+            return None
+
+        self._data[sid] = (time.monotonic() + self.ttl, session)
+        self._data.move_to_end(sid)
+        return session
+
+    def pop(self, sid):
+        self._data.pop(sid, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class RenderCache:
+    """Rendered card fragments by module path, for a single render context.
+
+    The context is whatever the cards depend on besides the module (prefix,
+    language, mirror url): a new context drops every card.
+    """
+
+    def __init__(self):
+        self._context = None
+        self._data = {}
+
+    def get(self, path, context, render):
+        if context != self._context:
+            self._data.clear()
+            self._context = context
+
+        card = self._data.get(path)
+        if card is None:
+            card = self._data[path] = render()
+        return card
+
+    def clear(self):
+        self._data.clear()
+
+
+class Stats:
+    """Per-stage timings: call counts and the last STATS_SAMPLES durations.
+
+    Stages are recorded from the search executor threads as well, hence the lock.
+    """
 
-            for search_query in [query, wildcard_query, fuzzy_query]:
-                results = searcher.search(search_query)
-                if results:
-                    return list(set(result["path"] for result in results))
-            return 0
+    def __init__(self, maxlen=STATS_SAMPLES):
+        self.maxlen = maxlen
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._samples = {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+            if stage not in self._samples:
+                self._samples[stage] = deque(maxlen=self.maxlen)
+            self._samples[stage].append(seconds * 1000)
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def summary(self):
+        """Returns {stage: {count, samples, mean, p50, p95, max, histogram}}, times in ms"""
+        with self._lock:
+            snapshot = {stage: sorted(samples) for stage, samples in self._samples.items()}
+            counts = dict(self._counts)
+
+        summary = {}
+        for stage, samples in snapshot.items():
+            histogram = {f"<={bound}": 0 for bound in STATS_BUCKETS}
+            histogram[f">{STATS_BUCKETS[-1]}"] = 0
+            for sample in samples:
+                bucket = next((f"<={bound}" for bound in STATS_BUCKETS if sample <= bound), f">{STATS_BUCKETS[-1]}")
+                histogram[bucket] += 1
+
+            summary[stage] = {
+                "count": counts[stage],
+                "samples": len(samples),
+                "mean": sum(samples) / len(samples),
+                "p50": samples[len(samples) // 2],
+                "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+                "max": samples[-1],
+                "histogram": histogram,
+            }
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+            self._samples.clear()
 
 
 class LimokaAPI:
-    async def get_all_modules(self, url):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                return json.loads(await response.text())
+    def __init__(self, session):
+        self.session = session
+
+    async def get_catalog(self, url, cached=None):
+        """Downloads the catalog, revalidating the cached copy with ETag / Last-Modified.
+
+        Returns the cached catalog itself when the server answers 304.
+        Raises ClientResponseError with status 404 if the file is not published.
+        """
+        async with self.session.get(url, headers=self._revalidation_headers(url, cached)) as response:
+            if response.status == 304 and cached:
+                return cached
+            if response.status not in (200, 404) and cached:
+                logger.warning("Can't fetch %s (%d), using cached catalog", url, response.status)
+                return cached
+            response.raise_for_status()
+
+            data = await response.read()
+            if url.endswith(".gz"):
+                # Some mirrors send it with Content-Encoding: gzip and it arrives decoded
+                if data[:2] == b"\x1f\x8b":
+                    data = gzip.decompress(data)
+                compact = json.loads(data)
+                version, modules = compact["version"], expand_catalog(compact)
+            else:
+                version, modules = hashlib.sha256(data).hexdigest(), json.loads(data)
+
+            return {
+                "version": version,
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "modules": modules,
+            }
+
+    async def get_mapping(self, url, cached=None):
+        """Downloads categories.json or similar.json, revalidating the cached copy like get_catalog"""
+        async with self.session.get(url, headers=self._revalidation_headers(url, cached)) as response:
+            if response.status == 304 and cached:
+                return cached
+            response.raise_for_status()
+
+            data = await response.read()
+            return {
+                "version": hashlib.sha256(data).hexdigest(),
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "data": json.loads(data),
+            }
+
+    async def get_delta(self, url, cached=None):
+        """Downloads the delta manifest, revalidating it with the validators of the last one.
+
+        Returns cached itself when it didn't change and None if it can't be
+        fetched, otherwise the validators with the manifest under "data".
+        """
+        try:
+            async with self.session.get(url, headers=self._revalidation_headers(url, cached)) as response:
+                if response.status == 304 and cached:
+                    return cached
+                if response.status != 200:
+                    return None
+
+                data = await response.read()
+                # Same as the compact catalog, mirrors may have decoded it already
+                if data[:2] == b"\x1f\x8b":
+                    data = gzip.decompress(data)
+                return {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "data": json.loads(data),
+                }
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _revalidation_headers(url, cached):
+        headers = {}
+        if cached and cached.get("url") == url:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        return headers
+
+    async def get_json(self, url):
+        """Downloads an optional json file (delta, index manifest), None if it is not published"""
+        try:
+            async with self.session.get(url) as response:
+                if response.status != 200:
+                    return None
+                return json.loads(await response.read())
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+    async def get_file(self, url):
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            return await response.read()
 
 
 @loader.tds
@@ -121,7 +668,24 @@ class Limoka(loader.Module):
         "apply_filters": "✅ Apply Filters",
         "clear_filters": "🗑 Clear Filters",
         "back_to_results": "🔙 Back to Results",
+        "similar": "🧩 Similar modules",
+        "similar_query": "similar to {name}",
+        "filter_safe": "🛡 Hide critical modules",
+        "risk": "🛡 Risk: {risk}",
+        "risk_critical": "⛔️ critical: {checks}",
+        "risk_warn": "🟡 warn: {checks}",
+        "risk_none": "✅ nothing suspicious",
         "empty_history": "<emoji document_id=5879939498149679716>🔎</emoji> <b>Your search history is empty!</b>",
+        "timeout": "<emoji document_id=5210952531676504517>❌</emoji> <b>Search took too long, try again</b>",
+        "inlinetimeout": "Search took too long, try again",
+        "session_expired": "These results have expired, search again",
+        "stats": (
+            "<emoji document_id=5431577498364158238>📊</emoji> <b>Limoka timings</b>, ms over the last {samples} calls:\n\n"
+            "{stats}"
+        ),
+        "stats_row": "<code>{stage}</code>: {count} calls, p50 {p50:.1f}, p95 {p95:.1f}, max {max:.1f}",
+        "stats_empty": "<emoji document_id=5431577498364158238>📊</emoji> <b>No timings recorded yet</b>",
+        "stats_reset": "<emoji document_id=5431577498364158238>📊</emoji> <b>Timings cleared</b>",
     }
 
     strings_ru = {
@@ -171,92 +735,523 @@ class Limoka(loader.Module):
         "apply_filters": "✅ Применить фильтры",
         "clear_filters": "🗑 Очистить фильтры",
         "back_to_results": "🔙 Вернуться к результатам",
+        "similar": "🧩 Похожие модули",
+        "similar_query": "похожие на {name}",
+        "filter_safe": "🛡 Скрыть критические модули",
+        "risk": "🛡 Риск: {risk}",
+        "risk_critical": "⛔️ критично: {checks}",
+        "risk_warn": "🟡 внимание: {checks}",
+        "risk_none": "✅ ничего подозрительного",
         "empty_history": "<emoji document_id=5879939498149679716>🔎</emoji> <b>Ваша история поиска пуста!</b>",
+        "timeout": "<emoji document_id=5210952531676504517>❌</emoji> <b>Поиск занял слишком много времени, попробуйте ещё раз</b>",
+        "inlinetimeout": "Поиск занял слишком много времени, попробуйте ещё раз",
+        "session_expired": "Эти результаты устарели, повторите поиск",
+        "stats": (
+            "<emoji document_id=5431577498364158238>📊</emoji> <b>Замеры Limoka</b>, мс за последние {samples} вызовов:\n\n"
+            "{stats}"
+        ),
+        "stats_row": "<code>{stage}</code>: {count} вызовов, p50 {p50:.1f}, p95 {p95:.1f}, макс. {max:.1f}",
+        "stats_empty": "<emoji document_id=5431577498364158238>📊</emoji> <b>Замеров пока нет</b>",
+        "stats_reset": "<emoji document_id=5431577498364158238>📊</emoji> <b>Замеры сброшены</b>",
     }
 
     def __init__(self):
-        self.api = LimokaAPI()
         self.config = loader.ModuleConfig(
             loader.ConfigValue(
                 "limokaurl",
                 "https://raw.githubusercontent.com/MuRuLOSE/limoka/refs/heads/main/",
                 lambda: "Mirror: https://raw.githubusercontent.com/MuRuLOSE/limoka-mirror/refs/heads/main/ (Dont work)",
                 validator=loader.validators.String(),
-            )
+            ),
+            loader.ConfigValue(
+                "inline_debounce",
+                0.3,
+                lambda: "Delay in seconds before an inline query is searched, newer queries cancel it",
+                validator=loader.validators.Float(minimum=0),
+            ),
+            loader.ConfigValue(
+                "cache_ttl",
+                300,
+                lambda: "How long search results are cached, in seconds",
+                validator=loader.validators.Integer(minimum=0),
+            ),
+            loader.ConfigValue(
+                "search_timeout",
+                5.0,
+                lambda: "Maximum time in seconds a single search may take",
+                validator=loader.validators.Float(minimum=0.1),
+            ),
         )
         self.name = self.strings["name"]
         self._daily_module = None
         self._last_update = None
+        self._query_cache = QueryCache()
+        self._sessions = ResultSessions()
+        self._cards = RenderCache()
+        self._inline_tasks = {}
+        self._url_cache = {}
+        self._prewarm_task = None
+        self._session = None
+        self._catalog_version = None
+        self._categories = {}
+        self._similar = {}
+        self._opens = {}
+        self._stats = Stats()
+        self._executor = ThreadPoolExecutor(SEARCH_WORKERS, thread_name_prefix="limoka-search")
 
     async def client_ready(self, client, db):
         self.client = client
         self.db = db
-        self.api = LimokaAPI()
-        self.schema = Schema(
-            title=TEXT(stored=True), 
-            path=ID(stored=True), 
-            content=TEXT(stored=True)
-        )
-
-        os.makedirs("limoka_search", exist_ok=True)
-        self.ix = (
-            create_in("limoka_search", self.schema)
-            if not os.path.isdir("limoka_search/index")
-            else open_dir("limoka_search")
+        self._session = self._create_session()
+        self.api = LimokaAPI(self._session)
+        self.indexer, doc_count = await self._run_in_executor(
+            self._open_index,
+            self.get("index_dir", "index"),
+            # Nothing recorded yet: a fresh install or one from before index directories
+            self.get("index_dir") is None,
         )
+        self.ix = self.indexer.ix
 
         self._history = self.pointer("history", [])
+        self._opens = self.pointer("opens", {})
         self._daily_module_storage = self.pointer("daily_module", {"date": None, "path": None})
-        self.modules = await self.api.get_all_modules(
-            f"{self.config['limokaurl']}modules.json"
-        )
+        now = time.time()
+        self._url_cache = {
+            url: entry
+            for url, entry in self.get("url_cache", {}).items()
+            if entry["expires"] > now
+        }
+        catalog = await self._load_modules()
+        self.modules = catalog["modules"]
+        self._categories = self._build_category_index(self.modules)
+        self._similar = catalog["similar"]
+        self._catalog_version = (catalog["version"], catalog["categories"])
+        if not doc_count or self.get("index_format") != INDEX_FORMAT:
+            # Fresh install or a new index format, where every module would be
+            # reindexed anyway: try the index prebuilt for this catalog
+            index_dir = self._new_index_dir()
+            self.indexer = await self._prepare_index(os.path.join(INDEX_DIR, index_dir), catalog)
+            self.ix = self.indexer.ix
+            self.set("index_dir", index_dir)
         await self._update_index()
+        self.set("index_format", INDEX_FORMAT)
+        # Started once the index is ready, so banner checks don't hold up its download
+        self._prewarm_task = asyncio.ensure_future(self._prewarm_url_cache())
+        self._query_cache = QueryCache(ttl=self.config["cache_ttl"])
         await self._check_daily_module()
 
+    def _open_index(self, index_dir, migrate=False):
+        """Opens the live index and its document count, runs in the executor.
+
+        Directories left behind by earlier refreshes are removed first, and
+        with migrate the index older versions kept in INDEX_DIR itself.
+        """
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        if migrate:
+            self._remove_root_index()
+        self._remove_stale_indexes(index_dir)
+        indexer = Indexer(os.path.join(INDEX_DIR, index_dir))
+        return indexer, indexer.ix.doc_count()
+
+    async def _run_in_executor(self, func, *args, timeout=None):
+        """Runs blocking Whoosh work in the search executor"""
+        future = asyncio.get_event_loop().run_in_executor(
+            self._executor, functools.partial(func, *args)
+        )
+        return await asyncio.wait_for(future, timeout)
+
+    async def _search(self, query, categories=None, hide_critical=False, limit=SEARCH_LIMIT):
+        """Searches the index without blocking the client, limited by search_timeout"""
+        with self._stats.measure("search"):
+            return await self._run_in_executor(
+                Search(query, self.ix, self._stats, dict(self._opens)).search_module,
+                categories,
+                hide_critical,
+                limit,
+                timeout=self.config["search_timeout"],
+            )
+
+    async def _session_path(self, session, index):
+        """Path at index of the session results, searching one page deeper if needed.
+
+        Returns None past the last result.
+        """
+        while index >= len(session.paths) and not session.exhausted:
+            limit = len(session.paths) + SEARCH_LIMIT
+            hits = await self._search(
+                session.query.lower(),
+                session.filters.get("category"),
+                session.filters.get("safe", False),
+                limit + 1,
+            )
+            session.extend([path for path, _ in hits], limit)
+        return session.paths[index] if index < len(session.paths) else None
+
+    @staticmethod
+    def _build_category_index(modules):
+        """Maps every category to the set of its module paths"""
+        categories = {}
+        for module_path, module_data in modules.items():
+            for category in module_data.get("category", []):
+                categories.setdefault(category, set()).add(module_path)
+        return categories
+
     async def _update_index(self):
-        writer = self.ix.writer()
-        for module_path, module_data in self.modules.items():
-            for content in [module_data["name"], module_data["description"]]:
-                writer.add_document(
-                    title=module_data["name"],
-                    path=module_path,
-                    content=content
-                )
-            for func in module_data["commands"]:
-                for command, description in func.items():
-                    writer.add_document(
-                        title=module_data["name"],
-                        path=module_path,
-                        content=command
-                    )
-                    writer.add_document(
-                        title=module_data["name"],
-                        path=module_path,
-                        content=description
-                    )
-        writer.commit()
+        with self._stats.measure("index_update"):
+            await self._run_in_executor(self.indexer.update, self.modules)
+
+    @staticmethod
+    def _build_index(dirname, modules):
+        indexer = Indexer(dirname)
+        indexer.update(modules)
+        return indexer
+
+    @staticmethod
+    def _copy_index(source, dirname, modules):
+        """Copies an index and reindexes in the copy only the modules that changed"""
+        shutil.rmtree(dirname, ignore_errors=True)
+        shutil.copytree(source, dirname, ignore=shutil.ignore_patterns("*LOCK"))
+        indexer = Indexer(dirname)
+        indexer.update(modules)
+        return indexer
+
+    @staticmethod
+    def _unpack_index(dirname, data):
+        shutil.rmtree(dirname, ignore_errors=True)
+        os.makedirs(dirname)
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r:gz") as archive:
+            members = archive.getmembers()
+            if any(not member.isfile() or os.path.basename(member.name) != member.name for member in members):
+                raise ValueError("Unexpected entry in the prebuilt index")
+            archive.extractall(dirname, members)
+        return Indexer(dirname)
+
+    async def _download_index(self, dirname, catalog):
+        """Fetches the index build_index.py prebuilt for this catalog version.
+
+        Returns None if it isn't published or was built for another catalog
+        or index format. Whoosh mmaps the unpacked segment files on open.
+        """
+        url = self.config["limokaurl"]
+        manifest = await self.api.get_json(f"{url}{INDEX_MANIFEST}")
+        if (
+            not manifest
+            or manifest.get("format") != INDEX_FORMAT
+            or manifest.get("catalog") != catalog["version"]
+            or manifest.get("categories") != catalog["categories"]
+        ):
+            return None
 
-    async def _validate_url(self, url: str) -> str:
-        if not url:
+        try:
+            data = await self.api.get_file(f"{url}{manifest['file']}")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.debug("Can't download the prebuilt index", exc_info=True)
+            return None
+
+        if hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+            logger.warning("Prebuilt index checksum mismatch, indexing locally")
+            return None
+
+        try:
+            return await self._run_in_executor(self._unpack_index, dirname, data)
+        except (tarfile.TarError, ValueError, OSError):
+            logger.warning("Can't unpack the prebuilt index, indexing locally", exc_info=True)
             return None
+
+    async def _prepare_index(self, dirname, catalog):
+        """Builds the index for the catalog, starting from the prebuilt one when possible"""
+        with self._stats.measure("index_download"):
+            indexer = await self._download_index(dirname, catalog)
+
+        with self._stats.measure("index_update"):
+            if indexer is None:
+                return await self._run_in_executor(self._build_index, dirname, catalog["modules"])
+
+            # Normally a no-op, fixes up anything the prebuilt index disagrees on
+            await self._run_in_executor(indexer.update, catalog["modules"])
+            return indexer
+
+    @staticmethod
+    def _new_index_dir():
+        """Name for a new index directory that no index uses yet"""
+        stamp = int(time.time())
+        while os.path.exists(os.path.join(INDEX_DIR, f"index-{stamp}")):
+            stamp += 1
+        return f"index-{stamp}"
+
+    @staticmethod
+    def _remove_root_index():
+        """Removes the Whoosh files older versions wrote straight into INDEX_DIR"""
+        caches = {os.path.basename(path) for path in (CATALOG_CACHE, CATEGORIES_CACHE, SIMILAR_CACHE)}
+        for name in os.listdir(INDEX_DIR):
+            path = os.path.join(INDEX_DIR, name)
+            if name not in caches and os.path.isfile(path):
+                os.remove(path)
+
+    @staticmethod
+    def _remove_stale_indexes(keep):
+        """Removes index directories left behind by previous refreshes"""
+        for name in os.listdir(INDEX_DIR):
+            path = os.path.join(INDEX_DIR, name)
+            if name != keep and name.startswith("index") and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+    @loader.loop(interval=CATALOG_REFRESH_INTERVAL, autostart=True, wait_before=True)
+    async def refresh_catalog(self):
+        """Picks up catalog updates without restarting the userbot"""
+        catalog = await self._load_modules()
+        self._similar = catalog["similar"]
+        if (catalog["version"], catalog["categories"]) == self._catalog_version:
+            return
+
+        # Searches keep using the current index while the new one is built
+        # next to it, the directory of the previous index is removed on the
+        # next refresh when nothing reads from it anymore
+        index_dir = self._new_index_dir()
+        live_dir = self.get("index_dir", "index")
+        await self._run_in_executor(self._remove_stale_indexes, live_dir)
+        # The live index is in the current format (client_ready sees to it),
+        # so a copy of it only needs the modules the update touched
+        try:
+            with self._stats.measure("index_update"):
+                indexer = await self._run_in_executor(
+                    self._copy_index,
+                    os.path.join(INDEX_DIR, live_dir),
+                    os.path.join(INDEX_DIR, index_dir),
+                    catalog["modules"],
+                )
+        except OSError:
+            logger.warning("Can't copy the search index, building it anew", exc_info=True)
+            indexer = await self._prepare_index(os.path.join(INDEX_DIR, index_dir), catalog)
+
+        categories = self._build_category_index(catalog["modules"])
+        self.modules, self._categories, self.indexer, self.ix = (
+            catalog["modules"],
+            categories,
+            indexer,
+            indexer.ix,
+        )
+        self._catalog_version = (catalog["version"], catalog["categories"])
+        self.set("index_dir", index_dir)
+        self._query_cache.clear()
+        # Open result pages point into the old catalog
+        self._sessions.clear()
+        self._cards.clear()
+
+        if self._prewarm_task:
+            self._prewarm_task.cancel()
+        self._prewarm_task = asyncio.ensure_future(self._prewarm_url_cache())
+        logger.debug("Catalog refreshed to %s (categories %s)", *self._catalog_version)
+
+    async def _read_catalog_cache(self, path=CATALOG_CACHE):
+        return await self._run_in_executor(self._read_json, path)
+
+    async def _write_catalog_cache(self, catalog, path=CATALOG_CACHE):
+        await self._run_in_executor(self._write_json, catalog, path)
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_json(data, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    async def _load_modules(self):
+        """Loads the catalog with categories.json merged into it and similar.json next to it.
+
+        "version" stays the catalog version, "categories" is the version of
+        the categories it was merged with.
+        """
+        with self._stats.measure("catalog_load"):
+            catalog = await self._load_catalog()
+            categories = await self._load_mapping(CATEGORIES_FILE, CATEGORIES_CACHE)
+            similar = await self._load_mapping(SIMILAR_FILE, SIMILAR_CACHE)
+        return {
+            **catalog,
+            "categories": categories["version"],
+            "modules": apply_categories(catalog["modules"], categories["data"]),
+            "similar": similar["data"],
+        }
+
+    async def _load_mapping(self, name, cache_path):
+        """Loads a {module path: ...} file, falls back to the cached copy or an empty one"""
+        cached = await self._read_catalog_cache(cache_path)
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.head(url, timeout=5) as response:
-                    if response.status != 200:
-                        return None
+            mapping = await self.api.get_mapping(f"{self.config['limokaurl']}{name}", cached)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            logger.debug("Can't fetch %s", name, exc_info=True)
+            return cached or {"version": None, "data": {}}
+
+        if mapping is not cached:
+            await self._write_catalog_cache(mapping, cache_path)
+        return mapping
+
+    async def _load_catalog(self):
+        """Loads the catalog, downloading only what changed since the cached copy"""
+        cached = await self._read_catalog_cache()
+        url = self.config["limokaurl"]
+
+        # Validators of the delta are kept only while the cached catalog is at
+        # its version, so an unchanged delta means an unchanged catalog
+        delta, manifest = None, None
+        if cached:
+            validators = cached.get("delta")
+            delta = await self.api.get_delta(f"{url}{DELTA_FILE}", validators)
+            if delta is not None and delta is validators:
+                return cached
+            if delta:
+                manifest = delta.pop("data")
+            if manifest and manifest["version"] == cached["version"]:
+                cached["delta"] = delta
+                await self._write_catalog_cache(cached)
+                return cached
+            if manifest and manifest["base"] == cached["version"]:
+                catalog = {
+                    "version": manifest["version"],
+                    "url": None,
+                    "etag": None,
+                    "last_modified": None,
+                    "modules": apply_delta(cached["modules"], manifest),
+                    "delta": delta,
+                }
+                await self._write_catalog_cache(catalog)
+                return catalog
+
+        for name in CATALOG_FILES:
+            try:
+                catalog = await self.api.get_catalog(f"{url}{name}", cached)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if isinstance(e, aiohttp.ClientResponseError) and e.status == 404:
+                    continue
+                if not cached:
+                    raise
+                # The mirror is unreachable, the cached catalog is better than none
+                logger.warning("Can't fetch %s, using cached catalog", name, exc_info=True)
+                return cached
+            except ValueError:
+                logger.warning("Can't read %s, trying the next catalog file", name, exc_info=True)
+                continue
+
+            validators = delta if manifest and manifest["version"] == catalog["version"] else None
+            if catalog is not cached or catalog.get("delta") != validators:
+                catalog["delta"] = validators
+                await self._write_catalog_cache(catalog)
+            return catalog
+
+        if cached:
+            return cached
+        raise RuntimeError(f"No catalog found at {url}")
+
+    async def on_unload(self):
+        if self._prewarm_task:
+            self._prewarm_task.cancel()
+        if self._session:
+            await self._session.close()
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _create_session():
+        """One keep-alive session for the catalog and url checks"""
+        return aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=HTTP_LIMIT,
+                limit_per_host=HTTP_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            ),
+            timeout=HTTP_TIMEOUT,
+        )
+
+    async def _check_url(self, url: str) -> dict:
+        status, content_type = None, ""
+        try:
+            with self._stats.measure("url_check"):
+                async with self._session.head(url, timeout=URL_CHECK_TIMEOUT) as response:
+                    status = response.status
                     content_type = response.headers.get("Content-Type", "")
-                    if not content_type.startswith("image/"):
-                        return None
-                    return url
         except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+        is_image = status == 200 and content_type.startswith("image/")
+        return {
+            "status": status,
+            "content_type": content_type,
+            "expires": time.time() + (URL_CACHE_TTL if is_image else URL_CACHE_NEGATIVE_TTL),
+        }
+
+    async def _validate_url(self, url: str, save: bool = True) -> str:
+        if not url:
+            return None
+
+        # The background prewarm (save=False) is kept apart from user-facing checks
+        with self._stats.measure("url_validate" if save else "url_prewarm"):
+            entry = self._url_cache.get(url)
+            if not entry or entry["expires"] < time.time():
+                entry = await self._check_url(url)
+                self._url_cache[url] = entry
+                if save:
+                    self.set("url_cache", self._url_cache)
+
+        if entry["status"] != 200 or not entry["content_type"].startswith("image/"):
             return None
+        return url
+
+    async def _prewarm_url_cache(self):
+        """Validates banners and pics of the whole catalog in the background"""
+        now = time.time()
+        urls = {
+            url
+            for module_data in self.modules.values()
+            for url in (module_data["meta"].get("banner"), module_data["meta"].get("pic"))
+            if url and (url not in self._url_cache or self._url_cache[url]["expires"] < now)
+        }
+        if not urls:
+            return
+
+        semaphore = asyncio.Semaphore(URL_PREWARM_CONCURRENCY)
+
+        async def validate(url):
+            async with semaphore:
+                await self._validate_url(url, save=False)
+
+        await asyncio.gather(*map(validate, urls))
+        self.set("url_cache", self._url_cache)
+        logger.debug("Validated %d banner urls", len(urls))
+
+    def _cache_lookup(self, query):
+        """Cached result of exactly this query.
+
+        Results of a prefix are not reused: n-gram, fuzzy and description
+        matches don't nest, and the score cut depends on the whole query.
+        """
+        with self._stats.measure("cache_lookup"):
+            return self._query_cache.get(query)
+
+    async def _cached_search(self, query):
+        paths = self._cache_lookup(query)
+        if paths is None:
+            paths = [path for path, _ in await self._search(query)]
+            self._query_cache.set(query, paths)
+        return paths
 
     async def _check_daily_module(self):
         """Проверяет и обновляет модуль дня если требуется"""
         current_date = datetime.now().date()
         stored_date = self._daily_module_storage.get("date")
         
-        if not stored_date or datetime.strptime(stored_date, "%Y-%m-%d").date() != current_date:
+        if (
+            not stored_date
+            or datetime.strptime(stored_date, "%Y-%m-%d").date() != current_date
+            or self._daily_module_storage.get("path") not in self.modules
+        ):
             all_paths = list(self.modules.keys())
             random_path = random.choice(all_paths)
             self._daily_module = {
@@ -289,108 +1284,234 @@ class Limoka(loader.Module):
                 )
         return commands
 
-    async def _display_filter_menu(self, call: InlineCall, query: str, current_filters: dict):
+    def _card(self, module_path):
+        """Cached card fragments of a module, see _render_card"""
+        # The found template stands for the language, it is all that changes with it
+        context = (self.get_prefix(), self.strings["found"], self.config["limokaurl"])
+        return self._cards.get(module_path, context, functools.partial(self._render_card, module_path))
+
+    def _render_card(self, module_path):
+        """Escapes and formats everything of a module card but the query.
+
+        The found caption is kept as the parts before and after the query.
+        """
+        with self._stats.measure("card_render"):
+            module_info = self.modules[module_path]
+            clean_module_path = module_path.replace("\\", "/")
+            commands = self.generate_commands(module_info)
+            fields = {
+                "name": module_info["name"] or self.strings["no_info"],
+                "description": html.escape(module_info["description"] or self.strings["no_info"]),
+                "url": self.config["limokaurl"],
+                "username": module_info["meta"].get("developer", "Unknown"),
+                "commands": "".join(commands),
+                "prefix": self.get_prefix(),
+                "module_path": clean_module_path,
+            }
+            head, _, tail = self.strings["found"].format(query="\0", **fields).partition("\0")
+            return {
+                **fields,
+                "found": (head, tail),
+                "dotd": self.strings["dotd"].format(**fields),
+                "short_commands": "".join(commands[:3]),
+                "download": (
+                    f"<emoji document_id=5411143117711624172>🪄</emoji> "
+                    f"<code>{fields['prefix']}dlm {fields['url']}{clean_module_path}</code>"
+                ),
+                "risk": self._risk_text(module_info),
+            }
+
+    @staticmethod
+    def _found_text(card, query):
+        head, tail = card["found"]
+        return f"{head}{query}{tail}"
+
+    def _caption(self, card, query, filters_text):
+        """Found caption with the filters, shortened to fit the 1024 characters of a photo caption"""
+        full_message = f"{self._found_text(card, query)}\n{filters_text}"
+        if len(full_message) <= 1024:
+            return full_message
+
+        max_content_length = 1024 - len(f"\n{card['download']}\n{filters_text}") - 50
+        if max_content_length < 100:
+            max_content_length = 100
+
+        description = card["description"]
+        if len(description) > max_content_length // 2:
+            description = description[:max_content_length // 2] + html.escape("...")
+        formatted_message = (
+            f"<emoji document_id=5413334818047940135>🔍</emoji> Found the module <b>{card['name']}</b> "
+            f"by query: <b>{query}</b>\n\n"
+            f"<b><emoji document_id=5418376169055602355>ℹ️</emoji> Description:</b> {description}\n"
+            f"<b><emoji document_id=5418299289141004396>🧑‍💻</emoji> Developer:</b> {card['username']}\n\n"
+            f"{card['short_commands']}\n"
+        ).strip()
+        return (
+            f"{formatted_message[:max_content_length]}"
+            f"{'...' if len(formatted_message) > max_content_length else ''}"
+            f"\n\n{card['download']}\n{filters_text}"
+        )
+
+    async def _open_session(self, call: InlineCall, sid: str):
+        """Result session of a callback, or None after telling the user it expired"""
+        session = self._sessions.get(sid)
+        if session is None:
+            await call.answer(self.strings["session_expired"])
+        return session
+
+    async def _open_filters(self, call: InlineCall, sid: str):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
+
+        session.draft = session.filters.copy()
+        await self._display_filter_menu(call, sid)
+
+    async def _display_filter_menu(self, call: InlineCall, sid: str):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
+
         markup = [
             [
-                {"text": self.strings["filter_cat"], "callback": self._select_category, "args": (query, current_filters)},
+                {"text": self.strings["filter_cat"], "callback": self._select_category, "args": (sid,)},
             ],
             [
-                {"text": self.strings["apply_filters"], "callback": self._apply_filters, "args": (query, current_filters)},
-                {"text": self.strings["clear_filters"], "callback": self._clear_filters, "args": (query,)},
+                {
+                    "text": f"{'✅ ' if session.draft.get('safe') else ''}{self.strings['filter_safe']}",
+                    "callback": self._toggle_safe,
+                    "args": (sid,),
+                },
             ],
             [
-                {"text": self.strings["back_to_results"], "callback": self._show_results, "args": (query, {})},
+                {"text": self.strings["apply_filters"], "callback": self._apply_filters, "args": (sid,)},
+                {"text": self.strings["clear_filters"], "callback": self._clear_filters, "args": (sid,)},
+            ],
+            [
+                {"text": self.strings["back_to_results"], "callback": self._show_results, "args": (sid,)},
             ]
         ]
         
-        categories = current_filters.get("category", [])
-        filters_text = f"Categories: {', '.join(categories) if categories else 'None'}"
+        filters_text = self._filters_text(session.draft)
         await call.edit(
-            self.strings["filter_menu"].format(query=query) + f"\n{filters_text}",
+            self.strings["filter_menu"].format(query=session.query) + f"\n{filters_text}",
             reply_markup=markup
         )
 
-    async def _select_category(self, call: InlineCall, query: str, current_filters: dict):
-        all_categories = set()
-        for module_data in self.modules.values():
-            all_categories.update(module_data.get("category", []))
-        categories = sorted(all_categories)
+    async def _select_category(self, call: InlineCall, sid: str):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
+
+        categories = sorted(self._categories)
 
         if not categories:
             await call.edit("No categories found in the module database!", reply_markup=[])
             return
 
-        selected_categories = current_filters.get("category", [])
+        selected_categories = session.draft.get("category", [])
         markup = [
-            [{"text": f"{'✅ ' if cat in selected_categories else ''}{cat}", 
+            [{"text": f"{'✅ ' if cat in selected_categories else ''}{cat} ({len(self._categories[cat])})", 
               "callback": self._toggle_category, 
-              "args": (query, current_filters, cat)}]
+              "args": (sid, cat)}]
             for cat in categories
         ]
-        markup.append([{"text": "🔙 Back", "callback": self._display_filter_menu, "args": (query, current_filters)}])
+        markup.append([{"text": "🔙 Back", "callback": self._display_filter_menu, "args": (sid,)}])
         
         await call.edit(
-            f"Select categories for query: <code>{query}</code>\n(You can select multiple)",
+            f"Select categories for query: <code>{session.query}</code>\n(You can select multiple)",
             reply_markup=markup
         )
 
-    async def _toggle_category(self, call: InlineCall, query: str, current_filters: dict, category: str):
-        new_filters = current_filters.copy()
-        selected_categories = new_filters.get("category", [])
+    async def _toggle_safe(self, call: InlineCall, sid: str):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
+
+        if session.draft.get("safe"):
+            del session.draft["safe"]
+        else:
+            session.draft["safe"] = True
+        await self._display_filter_menu(call, sid)
+
+    def _filters_text(self, filters):
+        categories = filters.get("category", [])
+        text = f"Categories: {', '.join(categories) if categories else 'None'}"
+        if filters.get("safe"):
+            text += f"\n{self.strings['filter_safe']}"
+        return text
+
+    def _risk_text(self, module_info):
+        """One line with the critical and warn checks parse.py found in the module"""
+        risk = module_info.get("risk")
+        if risk is None:
+            return ""
+        parts = [
+            self.strings[f"risk_{level}"].format(checks=", ".join(risk[level]))
+            for level in ("critical", "warn")
+            if risk.get(level)
+        ]
+        return self.strings["risk"].format(risk="; ".join(parts) or self.strings["risk_none"])
+
+    async def _toggle_category(self, call: InlineCall, sid: str, category: str):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
+
+        selected_categories = session.draft.get("category", [])
         
         if category in selected_categories:
-            selected_categories.remove(category)
+            selected_categories = [cat for cat in selected_categories if cat != category]
         else:
-            selected_categories.append(category)
+            selected_categories = [*selected_categories, category]
         
         if selected_categories:
-            new_filters["category"] = selected_categories
+            session.draft["category"] = selected_categories
         else:
-            new_filters.pop("category", None)
+            session.draft.pop("category", None)
         
-        await self._select_category(call, query, new_filters)
+        await self._select_category(call, sid)
 
-    async def _apply_filters(self, call: InlineCall, query: str, filters: dict):
-        await self._show_results(call, query, filters, from_filters=True)
+    async def _apply_filters(self, call: InlineCall, sid: str):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
+
+        session.reset(session.draft.copy())
+        await self._show_results(call, sid, from_filters=True)
+
+    async def _clear_filters(self, call: InlineCall, sid: str):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
 
-    async def _clear_filters(self, call: InlineCall, query: str):
-        await self._show_results(call, query, {}, from_filters=True)
+        session.draft = {}
+        session.reset({})
+        await self._show_results(call, sid, from_filters=True)
+
+    async def _show_results(self, call: InlineCall, sid: str, from_filters: bool = False):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
 
-    async def _show_results(self, call: InlineCall, query: str, filters: dict, from_filters: bool = False):
-        searcher = Search(query.lower(), self.ix)
         try:
-            result = searcher.search_module()
+            module_path = await self._session_path(session, 0)
         except IndexError:
             await call.edit(self.strings["?"], reply_markup=[])
             return
-
-        if not result or result == 0:
-            if from_filters:
-                markup = [[{"text": "🔙 Back", "callback": self._display_filter_menu, "args": (query, filters)}]]
-                await call.edit(self.strings["404"].format(query=query), reply_markup=markup)
-            else:
-                await call.edit(self.strings["404"].format(query=query), reply_markup=[])
+        except asyncio.TimeoutError:
+            await call.edit(self.strings["timeout"], reply_markup=[])
             return
 
-        if filters.get("category"):
-            filtered_result = [
-                path for path in result 
-                if any(cat in self.modules.get(path, {}).get("category", []) for cat in filters["category"])
-            ]
-        else:
-            filtered_result = result
-
-        if not filtered_result:
+        if module_path is None:
             if from_filters:
-                markup = [[{"text": "🔙 Back", "callback": self._display_filter_menu, "args": (query, filters)}]]
-                await call.edit(self.strings["404"].format(query=query), reply_markup=markup)
+                markup = [[{"text": "🔙 Back", "callback": self._display_filter_menu, "args": (sid,)}]]
+                await call.edit(self.strings["404"].format(query=session.query), reply_markup=markup)
             else:
-                await call.edit(self.strings["404"].format(query=query), reply_markup=[])
+                await call.edit(self.strings["404"].format(query=session.query), reply_markup=[])
             return
 
-        module_path = filtered_result[0]
-        module_info = self.modules[module_path]
-        await self._display_module(call, module_info, module_path, query, filtered_result, 0, filters)
+        await self._display_module(call, sid, session, 0)
 
     @loader.command()
     async def limokacmd(self, message: Message):
@@ -415,18 +1536,44 @@ class Limoka(loader.Module):
             ),
         )
 
-        searcher = Search(args.lower(), self.ix)
+        session = ResultSession(args)
         try:
-            result = searcher.search_module()
+            module_path = await self._session_path(session, 0)
         except IndexError:
             return await utils.answer(message, self.strings["?"])
+        except asyncio.TimeoutError:
+            return await utils.answer(message, self.strings["timeout"])
 
-        if not result or result == 0:
+        if module_path is None:
             return await utils.answer(message, self.strings["404"].format(query=args))
 
-        module_path = result[0]
-        module_info = self.modules[module_path]
-        await self._display_module(message, module_info, module_path, args, result, 0, {})
+        await self._display_module(message, self._sessions.create(session), session, 0)
+
+    @loader.command()
+    async def limokastats(self, message: Message):
+        """[json | reset] - Show how long searches, url checks and rendering take"""
+        args = utils.get_args_raw(message)
+        if args == "reset":
+            self._stats.clear()
+            return await utils.answer(message, self.strings["stats_reset"])
+
+        summary = self._stats.summary()
+        if not summary:
+            return await utils.answer(message, self.strings["stats_empty"])
+
+        if args == "json":
+            file = io.BytesIO(json.dumps(summary, indent=2).encode())
+            file.name = "limoka_stats.json"
+            return await utils.answer_file(message, file)
+
+        rows = [
+            self.strings["stats_row"].format(stage=stage, **stats)
+            for stage, stats in sorted(summary.items())
+        ]
+        await utils.answer(
+            message,
+            self.strings["stats"].format(samples=STATS_SAMPLES, stats="\n".join(rows)),
+        )
 
     @loader.command()
     async def lshistorycmd(self, message: Message):
@@ -454,147 +1601,151 @@ class Limoka(loader.Module):
 
         module_info = self._daily_module["info"]
         module_path = self._daily_module["path"]
-        
-        dev_username = module_info["meta"].get("developer", "Unknown")
-        name = module_info["name"] or self.strings["no_info"]
-        description = html.escape(module_info["description"] or self.strings["no_info"])
-        commands = self.generate_commands(module_info)
         banner = await self._validate_url(module_info["meta"].get("banner"))
+        formatted_message = self._card(module_path)["dotd"]
 
-        formatted_message = self.strings["dotd"].format(
-            name=name,
-            description=description,
-            url=self.config["limokaurl"],
-            username=dev_username,
-            commands="".join(commands),
-            prefix=self.get_prefix(),
-            module_path=module_path.replace("\\", "/"),
-        )
+        with self._stats.measure("render"):
+            try:
+                await self.inline.form(
+                    formatted_message,
+                    message,
+                    photo=banner or None
+                )
+            except (BadRequest, WebpageMediaEmptyError) as e:
+                await self.inline.form(
+                    formatted_message,
+                    message,
+                    photo=None
+                )
 
-        try:
-            await self.inline.form(
-                formatted_message,
-                message,
-                photo=banner or None
-            )
-        except (BadRequest, WebpageMediaEmptyError) as e:
-            await self.inline.form(
-                formatted_message,
-                message,
-                photo=None
-            )
+    async def _display_module(self, message_or_call, sid, session, index):
+        """Shows the module at index of a result session, which must already be fetched.
+
+        The session is passed in, it may have been dropped from ResultSessions
+        while the caller awaited. A path the current catalog doesn't know (after
+        a refresh or filters applied from an older card) counts as expired.
+        """
+        module_path = session.paths[index] if index < len(session.paths) else None
+        module_info = self.modules.get(module_path)
+        if module_info is None:
+            if isinstance(message_or_call, Message):
+                await utils.answer(message_or_call, self.strings["session_expired"])
+            else:
+                await message_or_call.answer(self.strings["session_expired"])
+            return
+
+        query, filters = session.query, session.filters
+        has_next = index + 1 < len(session.paths) or not session.exhausted
 
-    async def _display_module(self, message_or_call, module_info, module_path, query, result, index, filters):
-        dev_username = module_info["meta"].get("developer", "Unknown")
-        name = module_info["name"] or self.strings["no_info"]
-        description = html.escape(module_info["description"] or self.strings["no_info"])
         banner = await self._validate_url(module_info["meta"].get("banner"))
-        commands = self.generate_commands(module_info)
         page = index + 1
 
-        clean_module_path = module_path.replace('\\', '/')
-
-        formatted_message = self.strings["found"].format(
-            query=query,
-            name=name,
-            description=description,
-            url=self.config["limokaurl"],
-            username=dev_username,
-            commands="".join(commands),
-            prefix=self.get_prefix(),
-            module_path=clean_module_path,
-        )
+        if module_path not in session.opened:
+            session.opened.add(module_path)
+            self._opens[module_path] = self._opens.get(module_path, 0) + 1
 
-        categories = filters.get("category", [])
-        filters_text = f"Categories: {', '.join(categories) if categories else 'None'}"
-
-        full_message = formatted_message + f"\n{filters_text}"
-        if len(full_message) > 1024:
-            download_command = f"<emoji document_id=5411143117711624172>🪄</emoji> <code>{self.get_prefix()}dlm {self.config['limokaurl']}{clean_module_path}</code>"
-            max_content_length = 1024 - len(f"\n{download_command}\n{filters_text}") - 50
-            if max_content_length < 100:
-                max_content_length = 100
-            
-            description = (description[:max_content_length//2] + html.escape("...")) if len(description) > max_content_length//2 else description
-            commands = commands[:3] if len(commands) > 3 else commands
-            formatted_message = (
-                f"<emoji document_id=5413334818047940135>🔍</emoji> Found the module <b>{name}</b> "
-                f"by query: <b>{query}</b>\n\n"
-                f"<b><emoji document_id=5418376169055602355>ℹ️</emoji> Description:</b> {description}\n"
-                f"<b><emoji document_id=5418299289141004396>🧑‍💻</emoji> Developer:</b> {dev_username}\n\n"
-                f"{''.join(commands)}\n"
-            ).strip()
-            full_message = f"{formatted_message[:max_content_length]}{'...' if len(formatted_message) > max_content_length else ''}\n\n{download_command}\n{filters_text}"
-        else:
-            full_message = formatted_message + f"\n{filters_text}"
+        card = self._card(module_path)
+        filters_text = self._filters_text(filters)
+        if card["risk"]:
+            filters_text = f"{card['risk']}\n{filters_text}"
+        full_message = self._caption(card, query, filters_text)
 
         markup = [
             [
                 {
                     "text": "⏪" if index > 0 else "🚫",
                     "callback": self._previous_page if index > 0 else self._inline_void,
-                    "args": (result, index, query, filters) if index > 0 else (),
+                    "args": (sid, index) if index > 0 else (),
+                },
+                # More results are fetched only when the user pages past the loaded ones
+                {
+                    "text": f"{page}/{len(session.paths)}{'' if session.exhausted else '+'}",
+                    "callback": self._inline_void,
                 },
-                {"text": f"{page}/{len(result)}", "callback": self._inline_void},
                 {
-                    "text": "⏩" if index + 1 < len(result) else "🚫",
-                    "callback": self._next_page if index + 1 < len(result) else self._inline_void,
-                    "args": (result, index, query, filters) if index + 1 < len(result) else (),
+                    "text": "⏩" if has_next else "🚫",
+                    "callback": self._next_page if has_next else self._inline_void,
+                    "args": (sid, index) if has_next else (),
                 },
             ],
-            [
-                {"text": "🔍 Filters", "callback": self._display_filter_menu, "args": (query, filters)},
-            ]
+            [],
         ]
+        if session.searchable:
+            markup[1].append({"text": "🔍 Filters", "callback": self._open_filters, "args": (sid,)})
+        if self._similar.get(module_path):
+            markup[1].append(
+                {"text": self.strings["similar"], "callback": self._show_similar, "args": (module_path,)}
+            )
+        markup = [row for row in markup if row]
+
+        with self._stats.measure("render"):
+            try:
+                if isinstance(message_or_call, Message):
+                    await self.inline.form(
+                        full_message,
+                        message_or_call,
+                        reply_markup=markup,
+                        photo=banner or None
+                    )
+                else:
+                    await message_or_call.edit(
+                        full_message,
+                        reply_markup=markup,
+                        photo=banner or None
+                    )
+            except (BadRequest, WebpageMediaEmptyError) as e:
+                if isinstance(message_or_call, Message):
+                    await self.inline.form(
+                        full_message,
+                        message_or_call,
+                        reply_markup=markup,
+                        photo=None
+                    )
+                else:
+                    await message_or_call.edit(
+                        full_message,
+                        reply_markup=markup,
+                        photo=None
+                    )
+
+    async def _next_page(self, call: InlineCall, sid: str, index: int):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
 
         try:
-            if isinstance(message_or_call, Message):
-                await self.inline.form(
-                    full_message,
-                    message_or_call,
-                    reply_markup=markup,
-                    photo=banner or None
-                )
-            else:
-                await message_or_call.edit(
-                    full_message,
-                    reply_markup=markup,
-                    photo=banner or None
-                )
-        except (BadRequest, WebpageMediaEmptyError) as e:
-            if isinstance(message_or_call, Message):
-                await self.inline.form(
-                    full_message,
-                    message_or_call,
-                    reply_markup=markup,
-                    photo=None
-                )
-            else:
-                await message_or_call.edit(
-                    full_message,
-                    reply_markup=markup,
-                    photo=None
-                )
+            module_path = await self._session_path(session, index + 1)
+        except asyncio.TimeoutError:
+            await call.answer(self.strings["inlinetimeout"])
+            return
 
-    async def _next_page(self, call: InlineCall, result: list, index: int, query: str, filters: dict):
-        if index + 1 >= len(result):
+        if module_path is None:
             await call.answer("This is the last page!")
             return
 
-        index += 1
-        module_path = result[index]
-        module_info = self.modules[module_path]
-        await self._display_module(call, module_info, module_path, query, result, index, filters)
+        await self._display_module(call, sid, session, index + 1)
+
+    async def _previous_page(self, call: InlineCall, sid: str, index: int):
+        session = await self._open_session(call, sid)
+        if session is None:
+            return
 
-    async def _previous_page(self, call: InlineCall, result: list, index: int, query: str, filters: dict):
         if index - 1 < 0:
             await call.answer("This is the first page!")
             return
 
-        index -= 1
-        module_path = result[index]
-        module_info = self.modules[module_path]
-        await self._display_module(call, module_info, module_path, query, result, index, filters)
+        await self._display_module(call, sid, session, index - 1)
+
+    async def _show_similar(self, call: InlineCall, module_path: str):
+        """Pages through the modules categories.py found similar to module_path"""
+        result = [path for path in self._similar.get(module_path, []) if path in self.modules]
+        if not result:
+            await call.answer(self.strings["inline404"])
+            return
+
+        name = self.modules[module_path]["name"] if module_path in self.modules else module_path
+        session = ResultSession(self.strings["similar_query"].format(name=name), paths=result)
+        await self._display_module(call, self._sessions.create(session), session, 0)
 
     async def _inline_void(self, call: InlineCall):
         await call.answer()
@@ -610,9 +1761,29 @@ class Limoka(loader.Module):
                 "message": self.strings["inlinenoargs"],
             }
 
-        searcher = Search(query.args.lower(), self.ix)
+        user_id = query.from_user.id
+        previous = self._inline_tasks.pop(user_id, None)
+        if previous:
+            previous.cancel()
+
+        task = asyncio.ensure_future(self._inline_search(query))
+        self._inline_tasks[user_id] = task
         try:
-            results = searcher.search_module()
+            return await task
+        except asyncio.CancelledError:
+            # A newer query from the same user superseded this one
+            return None
+        finally:
+            if self._inline_tasks.get(user_id) is task:
+                del self._inline_tasks[user_id]
+
+    async def _inline_search(self, query: InlineQuery):
+        search_query = query.args.lower()
+        try:
+            results = self._cache_lookup(search_query)
+            if results is None:
+                await asyncio.sleep(self.config["inline_debounce"])
+                results = await self._cached_search(search_query)
         except IndexError:
             return {
                 "title": "Something went wrong...",
@@ -620,6 +1791,13 @@ class Limoka(loader.Module):
                 "thumb": "https://img.icons8.com/?size=100&id=rUSWMuGVdxJj&format=png&color=000000",
                 "message": self.strings["inline?"],
             }
+        except asyncio.TimeoutError:
+            return {
+                "title": "Something went wrong...",
+                "description": self.strings["inlinetimeout"],
+                "thumb": "https://img.icons8.com/?size=100&id=rUSWMuGVdxJj&format=png&color=000000",
+                "message": self.strings["inlinetimeout"],
+            }
 
         if not results:
             return {
@@ -629,30 +1807,22 @@ class Limoka(loader.Module):
                 "message": self.strings["inline404"],
             }
 
-        inline_results = []
-        for path in results:
-            module_info = self.modules.get(path)
-            if module_info and module_info.get("commands"):
-                banner = await self._validate_url(module_info["meta"].get("banner"))
-                thumb = await self._validate_url(
-                    module_info["meta"].get("pic", "https://img.icons8.com/?size=100&id=olDsW0G3zz22&format=png&color=000000")
-                )
-                inline_results.append(
-                    {
-                        "title": utils.escape_html(module_info["name"]),
-                        "description": utils.escape_html(module_info["description"]),
-                        "thumb": thumb or "https://img.icons8.com/?size=100&id=olDsW0G3zz22&format=png&color=000000",
-                        "photo": banner or "https://habrastorage.org/getpro/habr/upload_files/9c7/5fa/c54/9c75fac54ebb0beaf89abd7d86b4787c.jpg",
-                        "message": self.strings["found"].format(
-                            name=module_info["name"],
-                            query=query.args,
-                            url=self.config["limokaurl"],
-                            description=module_info["description"],
-                            username=module_info["meta"].get("developer", "Unknown"),
-                            commands="".join(self.generate_commands(module_info)),
-                            module_path=path.replace("\\", "/"),
-                            prefix=self.get_prefix(),
-                        ),
-                    }
-                )
+        with self._stats.measure("inline_results"):
+            inline_results = []
+            for path in results:
+                module_info = self.modules.get(path)
+                if module_info and module_info.get("commands"):
+                    banner = await self._validate_url(module_info["meta"].get("banner"))
+                    thumb = await self._validate_url(
+                        module_info["meta"].get("pic", "https://img.icons8.com/?size=100&id=olDsW0G3zz22&format=png&color=000000")
+                    )
+                    inline_results.append(
+                        {
+                            "title": utils.escape_html(module_info["name"]),
+                            "description": utils.escape_html(module_info["description"]),
+                            "thumb": thumb or "https://img.icons8.com/?size=100&id=olDsW0G3zz22&format=png&color=000000",
+                            "photo": banner or "https://habrastorage.org/getpro/habr/upload_files/9c7/5fa/c54/9c75fac54ebb0beaf89abd7d86b4787c.jpg",
+                            "message": self._found_text(self._card(path), query.args),
+                        }
+                    )
         return inline_results
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""Compares size and load time of modules.json and its compact form.
+
+Run from the repository root after parse.py: python3 bench_catalog.py
+"""
+import gzip
+import json
+import time
+
+from catalog import (
+    load_catalog,
+    dump_catalog,
+    dump_compact_catalog,
+    expand_catalog,
+)
+
+
+def best_of(func, rounds=20):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+modules, version = load_catalog()
+full = dump_catalog(modules)
+full_gz = gzip.compress(full, compresslevel=9, mtime=0)
+compact_gz = dump_compact_catalog(modules, version)
+compact = gzip.decompress(compact_gz)
+
+print(f"{len(modules)} modules, version {version[:12]}")
+print(f"{'format':<28}{'size, KiB':>12}{'load, ms':>12}")
+for name, data, load in [
+    ("modules.json", full, lambda: json.loads(full)),
+    ("modules.json (gzip)", full_gz, lambda: json.loads(gzip.decompress(full_gz))),
+    ("compact (raw)", compact, lambda: expand_catalog(json.loads(compact))),
+    ("modules.compact.json.gz", compact_gz, lambda: expand_catalog(json.loads(gzip.decompress(compact_gz)))),
+]:
+    print(f"{name:<28}{len(data) / 1024:>12.1f}{best_of(load):>12.2f}")
@@ -0,0 +1,139 @@
+"""Offline search benchmark for Limoka: latency, index size and recall.
+
+Run from the repository root after parse.py: python3 bench_search.py
+Needs whoosh and aiohttp. The search engine is loaded from Limoka.py the
+same way build_index.py does, so no Telegram client is involved.
+
+The query corpus is generated from the catalog with a fixed seed: module
+names, command names, typos of both and description words, each labeled
+with the module it came from. Extra labeled queries can be added with
+--queries file.json ([{"query": "...", "expected": ["path", ...]}, ...]).
+The number of results per query shows how much the score threshold cuts.
+"""
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from build_index import load_engine, load_categories
+from catalog import load_catalog
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def typo(word, rng):
+    """One edit: drop, swap or duplicate a character."""
+    i = rng.randrange(len(word) - 1)
+    edit = rng.choice(("drop", "swap", "double"))
+    if edit == "drop":
+        return word[:i] + word[i + 1:]
+    if edit == "swap":
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + word[i] + word[i:]
+
+
+def build_corpus(modules, size, seed=0):
+    """[(kind, query, expected paths)] sampled from the catalog."""
+    rng = random.Random(seed)
+    paths = sorted(modules)
+    corpus = []
+    for path in rng.sample(paths, min(size, len(paths))):
+        data = modules[path]
+        name = data["name"].replace("Mod", "") or data["name"]
+        commands = [
+            command.replace("cmd", "")
+            for func in data.get("commands", [])
+            for command in func
+            if len(command.replace("cmd", "")) > 3
+        ]
+        words = [
+            word.strip(".,!?()\"'").lower()
+            for word in (data.get("description") or "").split()
+            if len(word) > 5
+        ]
+
+        corpus.append(("name", name.lower(), [path]))
+        if len(name) > 4:
+            corpus.append(("name typo", typo(name.lower(), rng), [path]))
+        if commands:
+            command = rng.choice(commands).lower()
+            corpus.append(("command", command, [path]))
+            corpus.append(("command typo", typo(command, rng), [path]))
+        if words:
+            corpus.append(("description", rng.choice(words), [path]))
+    return corpus
+
+
+def index_size(dirname):
+    return sum(os.path.getsize(os.path.join(dirname, name)) for name in os.listdir(dirname))
+
+
+def run(engine, modules, corpus, k, rounds):
+    dirname = tempfile.mkdtemp(prefix="limoka-bench-")
+    try:
+        started = time.perf_counter()
+        indexer = engine["Indexer"](dirname)
+        indexer.update(modules)
+        build_time = time.perf_counter() - started
+        size = index_size(dirname)
+
+        Search = engine["Search"]
+        latencies, hits, counts = [], {}, []
+        for _ in range(rounds):
+            for kind, query, expected in corpus:
+                started = time.perf_counter()
+                try:
+                    results = [path for path, _ in Search(query, indexer.ix).search_module()]
+                except IndexError:
+                    results = []
+                latencies.append(time.perf_counter() - started)
+                counts.append(len(results))
+                found = any(path in results[:k] for path in expected)
+                hits.setdefault(kind, []).append(found)
+        indexer.ix.close()
+    finally:
+        shutil.rmtree(dirname, ignore_errors=True)
+    return build_time, size, latencies, hits, counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--catalog", default="modules.json")
+    parser.add_argument("--queries", help="json file with extra labeled queries")
+    parser.add_argument("--size", type=int, default=200, help="modules sampled for the generated corpus")
+    parser.add_argument("-k", type=int, default=5, help="cutoff for recall@k")
+    parser.add_argument("--rounds", type=int, default=1, help="times the corpus is replayed")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    engine = load_engine()
+    modules, version = load_catalog(args.catalog)
+    categories, _ = load_categories(engine["CATEGORIES_FILE"])
+    modules = engine["apply_categories"](modules, categories)
+
+    corpus = build_corpus(modules, args.size, args.seed)
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            corpus += [("labeled", item["query"], item["expected"]) for item in json.load(f)]
+
+    build_time, size, latencies, hits, counts = run(engine, modules, corpus, args.k, args.rounds)
+
+    print(f"Catalog {(version or '-')[:12]}: {len(modules)} modules, {len(corpus)} queries x {args.rounds}")
+    print(f"Index build: {build_time:.2f}s, {size / 1024:.1f} KiB on disk")
+    print(
+        "Latency: "
+        + ", ".join(f"p{q} {percentile(latencies, q) * 1000:.2f}ms" for q in (50, 95, 99))
+        + f", max {max(latencies) * 1000:.2f}ms"
+    )
+    print(f"Results per query: mean {sum(counts) / len(counts):.1f}, p50 {percentile(counts, 50)}")
+    print(f"{'queries':<16}{'count':>8}{f'recall@{args.k}':>12}")
+    for kind, found in sorted(hits.items()):
+        print(f"{kind:<16}{len(found) // args.rounds:>8}{sum(found) / len(found):>12.3f}")
+    total = [hit for found in hits.values() for hit in found]
+    print(f"{'all':<16}{len(total) // args.rounds:>8}{sum(total) / len(total):>12.3f}")
@@ -0,0 +1,115 @@
+"""Prebuilds the Limoka search index for the published catalog.
+
+Run from the repository root after categories.py: python3 build_index.py
+Needs whoosh and aiohttp, the index is built by Limoka.py's own Indexer so
+clients can use it as is when search_index.json matches their catalog.
+"""
+import io
+import os
+import ast
+import gzip
+import json
+import shutil
+import hashlib
+import tarfile
+import tempfile
+
+from catalog import load_catalog
+
+MODULE_PATH = "Limoka.py"
+ARCHIVE_PATH = "search_index.tar.gz"
+
+
+def load_engine(path=MODULE_PATH):
+    """Execute the search engine part of Limoka.py without Hikka.
+
+    Drops the Hikka/Telegram imports and the loader.Module subclass, keeps
+    the constants, helpers, Search, Indexer and the rest.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), path)
+
+    def is_hikka(node):
+        if isinstance(node, ast.ImportFrom):
+            return node.level > 0 or node.module.split(".")[0] in ("telethon", "aiogram")
+        if isinstance(node, ast.Try):
+            return True
+        if isinstance(node, ast.ClassDef):
+            return any(ast.unparse(base) == "loader.Module" for base in node.bases)
+        return False
+
+    tree.body = [node for node in tree.body if not is_hikka(node)]
+    engine = {"__name__": "limoka_engine"}
+    exec(compile(tree, path, "exec"), engine)
+    return engine
+
+
+def load_categories(path):
+    """categories.json written by categories.py and its version, as Limoka computes it."""
+    if not os.path.exists(path):
+        return {}, None
+    with open(path, "rb") as f:
+        data = f.read()
+    return json.loads(data), hashlib.sha256(data).hexdigest()
+
+
+def pack_index(dirname):
+    """tar.gz of the index files, without lock files and build-time metadata."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for name in sorted(os.listdir(dirname)):
+            if name.endswith("LOCK"):
+                continue
+            with open(os.path.join(dirname, name), "rb") as f:
+                data = f.read()
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            archive.addfile(info, io.BytesIO(data))
+    return gzip.compress(buffer.getvalue(), compresslevel=9, mtime=0)
+
+
+if __name__ == "__main__":
+    engine = load_engine()
+    modules, version = load_catalog()
+    categories, categories_version = load_categories(engine["CATEGORIES_FILE"])
+    modules = engine["apply_categories"](modules, categories)
+    manifest_path = engine["INDEX_MANIFEST"]
+
+    if os.path.exists(manifest_path) and os.path.exists(ARCHIVE_PATH):
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if (
+            manifest.get("format") == engine["INDEX_FORMAT"]
+            and manifest.get("catalog") == version
+            and manifest.get("categories") == categories_version
+        ):
+            print(f"Index for catalog {version[:12]} is up to date")
+            raise SystemExit
+
+    dirname = tempfile.mkdtemp(prefix="limoka-index-")
+    try:
+        indexer = engine["Indexer"](dirname)
+        indexer.update(modules)
+        # One segment, the client only reads it
+        indexer.ix.optimize()
+        indexer.ix.close()
+        data = pack_index(dirname)
+    finally:
+        shutil.rmtree(dirname, ignore_errors=True)
+
+    with open(ARCHIVE_PATH, "wb") as f:
+        f.write(data)
+
+    manifest = {
+        "format": engine["INDEX_FORMAT"],
+        "catalog": version,
+        "categories": categories_version,
+        "file": ARCHIVE_PATH,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Index for catalog {version[:12]}: {len(modules)} modules, {len(data) / 1024:.1f} KiB")
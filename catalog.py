@@ -0,0 +1,132 @@
+import os
+import gzip
+import json
+import hashlib
+
+CATALOG_PATH = "modules.json"
+DELTA_PATH = "modules.delta.json.gz"
+COMPACT_PATH = "modules.compact.json.gz"
+COMPACT_FORMAT = 1
+
+
+def dump_catalog(modules):
+    """Serialize the catalog exactly as it is published."""
+    return json.dumps(modules, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def catalog_version(data):
+    """Version of a published catalog is the SHA-256 of its bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_catalog(path=CATALOG_PATH):
+    """Load the published catalog and its version, or an empty one."""
+    if not os.path.exists(path):
+        return {}, None
+    with open(path, "rb") as f:
+        data = f.read()
+    return json.loads(data), catalog_version(data)
+
+
+def diff_catalogs(old, new):
+    """Return added, changed and removed modules between two catalogs."""
+    return {
+        "added": {path: data for path, data in new.items() if path not in old},
+        "changed": {
+            path: data
+            for path, data in new.items()
+            if path in old and old[path] != data
+        },
+        "removed": sorted(path for path in old if path not in new),
+    }
+
+
+def _command_row(command, new_command):
+    """Single row of the command table, or None if the pair can't be rebuilt from it."""
+    (name, description), = command.items()
+    (short_name, docs), = new_command.items()
+    row = [name, docs["doc"], docs["ru_doc"], docs["en_doc"]]
+    if short_name != name.replace("cmd", "") or description != " ".join(filter(None, row[1:])):
+        return None
+    return row
+
+
+def compact_catalog(modules, version):
+    """Build the compact catalog: commands and new_commands share one table.
+
+    Modules whose commands can't be normalized are stored as they are.
+    """
+    rows, row_ids, compact_modules = [], {}, {}
+    for path, data in modules.items():
+        commands, new_commands = data.get("commands"), data.get("new_commands")
+        command_rows = (
+            [_command_row(*pair) for pair in zip(commands, new_commands)]
+            if commands is not None and new_commands is not None and len(commands) == len(new_commands)
+            else [None]
+        )
+        if None in command_rows:
+            compact_modules[path] = data
+            continue
+
+        ids = []
+        for row in command_rows:
+            key = json.dumps(row, ensure_ascii=False)
+            if key not in row_ids:
+                row_ids[key] = len(rows)
+                rows.append(row)
+            ids.append(row_ids[key])
+
+        module = {key: value for key, value in data.items() if key not in ("commands", "new_commands")}
+        module["command_ids"] = ids
+        compact_modules[path] = module
+
+    return {"format": COMPACT_FORMAT, "version": version, "commands": rows, "modules": compact_modules}
+
+
+def expand_catalog(compact):
+    """Rebuild the modules.json structure from the compact catalog."""
+    rows = compact["commands"]
+    modules = {}
+    for path, data in compact["modules"].items():
+        if "command_ids" not in data:
+            modules[path] = data
+            continue
+
+        module = {key: value for key, value in data.items() if key != "command_ids"}
+        module["commands"], module["new_commands"] = [], []
+        for command_id in data["command_ids"]:
+            name, doc, ru_doc, en_doc = rows[command_id]
+            module["commands"].append({name: " ".join(filter(None, (doc, ru_doc, en_doc)))})
+            module["new_commands"].append(
+                {name.replace("cmd", ""): {"ru_doc": ru_doc, "en_doc": en_doc, "doc": doc}}
+            )
+        modules[path] = module
+    return modules
+
+
+def dump_compact_catalog(modules, version):
+    data = json.dumps(compact_catalog(modules, version), ensure_ascii=False, separators=(",", ":"))
+    # mtime=0 keeps the archive byte-identical for identical catalogs
+    return gzip.compress(data.encode("utf-8"), compresslevel=9, mtime=0)
+
+
+def write_catalog(modules):
+    """Write modules.json, its compact form and a gzipped delta manifest against the previous version."""
+    previous, previous_version = load_catalog()
+    delta = diff_catalogs(previous, modules)
+
+    data = dump_catalog(modules)
+    with open(CATALOG_PATH, "wb") as f:
+        f.write(data)
+
+    manifest = {"base": previous_version, "version": catalog_version(data), **delta}
+    with open(COMPACT_PATH, "wb") as f:
+        f.write(dump_compact_catalog(modules, manifest["version"]))
+    with open(DELTA_PATH, "wb") as f:
+        f.write(gzip.compress(json.dumps(manifest, ensure_ascii=False).encode("utf-8"), compresslevel=9, mtime=0))
+
+    print(
+        f"Catalog {manifest['version'][:12]}: {len(delta['added'])} added, "
+        f"{len(delta['changed'])} changed, {len(delta['removed'])} removed"
+    )
+    return manifest
@@ -1,10 +1,30 @@
 import json
+import time
+import pickle
+import hashlib
+
+import numpy as np
+import sklearn
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
 from sklearn.multiclass import OneVsRestClassifier
 from sklearn.preprocessing import MultiLabelBinarizer
-from tqdm import tqdm
-import numpy as np
+
+from catalog import load_catalog
+
+# Увеличивать при изменении обучения или get_module_text
+MODEL_VERSION = 1
+MODEL_PATH = "categories.model.pkl"
+CATEGORY_CACHE_PATH = ".categories_cache.json"
+CATEGORIES_PATH = "categories.json"
+SIMILAR_PATH = "similar.json"
+
+SIMILAR_COUNT = 5
+SIMILAR_MIN_SCORE = 0.1
+SIMILAR_BATCH = 512  # строк матрицы сходства за раз, ограничивает память
+
+THRESHOLD = 0.2  # Сниженный порог для большего разнообразия
+MAX_CATEGORIES = 2
 
 # Тренировочные данные (48 модулей)
 training_data = {
@@ -75,52 +95,161 @@ def get_module_text(module_path, module_data):
     return f"{file_name} {name} {description} {file_path} {commands_text} {new_commands_text}".strip()
 
 
-with open("modules.json", "r", encoding="utf-8") as f:
-    modules = json.load(f)
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def model_key(train_texts, train_labels):
+    """Ключ модели: меняется вместе с обучающими данными, параметрами и версией sklearn."""
+    data = json.dumps(
+        {
+            "version": MODEL_VERSION,
+            "sklearn": sklearn.__version__,
+            "categories": all_categories,
+            "threshold": THRESHOLD,
+            "max_categories": MAX_CATEGORIES,
+            "texts": train_texts,
+            "labels": train_labels,
+        },
+        ensure_ascii=False,
+    )
+    return text_hash(data)
 
-# Подготовка тренировочных данных
-train_texts = [get_module_text(path, modules[path]) for path in training_data.keys() if path in modules]
-train_labels = [training_data[path] for path in training_data.keys() if path in modules]
 
-# Векторизация текста
-vectorizer = TfidfVectorizer(max_features=2000)
-X_train = vectorizer.fit_transform(train_texts)
+def train_model(train_texts, train_labels):
+    # Векторизация текста
+    vectorizer = TfidfVectorizer(max_features=2000)
+    X_train = vectorizer.fit_transform(train_texts)
 
-# Преобразование меток
-mlb = MultiLabelBinarizer(classes=all_categories)
-y_train = mlb.fit_transform(train_labels)
+    # Преобразование меток
+    mlb = MultiLabelBinarizer(classes=all_categories)
+    y_train = mlb.fit_transform(train_labels)
 
-# Обучение модели с балансировкой классов
-base_clf = LogisticRegression(class_weight="balanced", max_iter=1000)
-clf = OneVsRestClassifier(base_clf)
-clf.fit(X_train, y_train)
+    # Обучение модели с балансировкой классов
+    clf = OneVsRestClassifier(LogisticRegression(class_weight="balanced", max_iter=1000))
+    clf.fit(X_train, y_train)
+    return {"vectorizer": vectorizer, "mlb": mlb, "clf": clf}
 
-# Обработка всех модулей
-print("Classifying all modules...")
-texts = [get_module_text(path, data) for path, data in modules.items()]
-X_all = vectorizer.transform(texts)
 
-# Предсказание вероятностей
-probs = clf.predict_proba(X_all)
+def load_model(modules):
+    """Загружает сохранённую модель или обучает новую, если изменились данные."""
+    train_paths = [path for path in training_data if path in modules]
+    train_texts = [get_module_text(path, modules[path]) for path in train_paths]
+    train_labels = [training_data[path] for path in train_paths]
+    key = model_key(train_texts, train_labels)
 
-# Присваивание категорий
-threshold = 0.2  # Снижаем порог для большего разнообразия
-for module_path, prob_vector in tqdm(zip(modules.keys(), probs), total=len(modules), desc="Assigning categories"):
-    module_data = modules[module_path]
+    try:
+        with open(MODEL_PATH, "rb") as f:
+            model = pickle.load(f)
+        if model.get("key") == key:
+            return model
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        pass
+
+    print("Training category model...")
+    model = {"key": key, **train_model(train_texts, train_labels)}
+    with open(MODEL_PATH, "wb") as f:
+        pickle.dump(model, f)
+    return model
+
+
+def load_category_cache(key):
+    """Кэш {хэш текста модуля: категории}, действителен только для своей модели."""
+    try:
+        with open(CATEGORY_CACHE_PATH, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("model") != key:
+        return {}
+    return cache["texts"]
+
+
+def save_category_cache(key, texts):
+    with open(CATEGORY_CACHE_PATH, "w", encoding="utf-8") as f:
+        json.dump({"model": key, "texts": texts}, f, ensure_ascii=False)
+
+
+def select_categories(model, prob_vector):
     sorted_indices = np.argsort(prob_vector)[::-1]
-    sorted_probs = prob_vector[sorted_indices]
-    sorted_labels = mlb.classes_[sorted_indices]
-    
-    selected_categories = [label for label, prob in zip(sorted_labels, sorted_probs) if prob >= threshold][:2]
-    
-    if not selected_categories:
-        selected_categories = ["Other"]
-    
-    module_data["category"] = selected_categories
-    print(f"Module: {module_path} -> Categories: {selected_categories} (top probs: {[f'{p:.2f}' for p in sorted_probs[:3]]})")
-
-# Сохранение результата
-with open("modules.json", "w", encoding="utf-8") as f:
-    json.dump(modules, f, ensure_ascii=False, indent=2)
-
-print("Done! Check modules_categorized.json.")
\ No newline at end of file
+    selected = [
+        str(model["mlb"].classes_[index])
+        for index in sorted_indices[:MAX_CATEGORIES]
+        if prob_vector[index] >= THRESHOLD
+    ]
+    return selected or ["Other"]
+
+
+def classify_modules(modules):
+    """Классифицирует только новые и изменившиеся модули, остальные берёт из кэша."""
+    model = load_model(modules)
+    cache = load_category_cache(model["key"])
+
+    hashes = {path: text_hash(get_module_text(path, data)) for path, data in modules.items()}
+    pending = {}
+    for path, data in modules.items():
+        if hashes[path] not in cache:
+            pending.setdefault(hashes[path], get_module_text(path, data))
+
+    if pending:
+        # Одним пакетом: векторизация и предсказание вероятностей
+        probs = model["clf"].predict_proba(model["vectorizer"].transform(list(pending.values())))
+        for digest, prob_vector in zip(pending, probs):
+            cache[digest] = select_categories(model, prob_vector)
+
+    save_category_cache(model["key"], {digest: cache[digest] for digest in set(hashes.values())})
+    return {path: cache[hashes[path]] for path in modules}, len(pending)
+
+
+def similar_modules(modules, count=SIMILAR_COUNT):
+    """Для каждого модуля - до count самых похожих по косинусной близости TF-IDF.
+
+    Векторизатор обучается на текстах всех модулей, строки TF-IDF
+    нормированы, поэтому произведение разреженных матриц и есть косинус.
+    """
+    paths = list(modules)
+    if len(paths) < 2:
+        return {}
+    X = TfidfVectorizer(sublinear_tf=True).fit_transform(
+        [get_module_text(path, modules[path]) for path in paths]
+    )
+
+    similar = {}
+    for start in range(0, len(paths), SIMILAR_BATCH):
+        scores = (X[start:start + SIMILAR_BATCH] @ X.T).toarray()
+        for offset, row in enumerate(scores):
+            row[start + offset] = 0  # сам модуль
+            kth = np.partition(row, len(row) - min(count, len(row)))[len(row) - min(count, len(row))]
+            candidates = np.nonzero(row >= max(kth, SIMILAR_MIN_SCORE))[0]
+            # Стабильный порядок при равных оценках: по пути
+            top = sorted(candidates, key=lambda i: (-row[i], paths[i]))[:count]
+            neighbours = [paths[i] for i in top]
+            if neighbours:
+                similar[paths[start + offset]] = neighbours
+    return similar
+
+
+def dump_map(data):
+    """Компактная карта {путь модуля: ...}, Limoka сам добавляет её к каталогу."""
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    modules, _ = load_catalog()
+    categories, classified = classify_modules(modules)
+
+    with open(CATEGORIES_PATH, "wb") as f:
+        f.write(dump_map(categories))
+
+    print(
+        f"Categories for {len(categories)} modules ({classified} classified, "
+        f"{len(categories) - classified} from cache) in {time.perf_counter() - started:.2f}s"
+    )
+
+    started = time.perf_counter()
+    similar = similar_modules(modules)
+    with open(SIMILAR_PATH, "wb") as f:
+        f.write(dump_map(similar))
+
+    print(f"Similar modules for {len(similar)} modules in {time.perf_counter() - started:.2f}s")
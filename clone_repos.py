@@ -1,8 +1,12 @@
 import os
+import json
 import shutil
+import hashlib
 import subprocess
 import re
-import requests
+import time
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 repos = [
     "https://github.com/Den4ikSuperOstryyPer4ik/Astro-modules",
@@ -23,6 +27,14 @@ repos = [
     "https://github.com/mead0wsss/mead0wsMods"
 ]
 
+# Clones are network bound, so the total time is close to the slowest repo
+CLONE_WORKERS = 16
+
+# Remote HEAD of every synced repository, unchanged ones aren't cloned again
+REPOS_LOCK_PATH = "repos.lock.json"
+# Files added, modified or removed by the last sync, see parse.py --changed
+CHANGED_FILES_PATH = "changed_files.json"
+
 def configure_git():
     """Configure Git to ignore file mode changes."""
     try:
@@ -36,22 +48,16 @@ def configure_git():
     except subprocess.CalledProcessError as e:
         print(f"Error configuring Git: {e.stderr}")
 
-def is_repo_public(repo_url):
-    """Check if the repository is accessible."""
+def get_remote_head(repo_url):
+    """Return the remote HEAD commit SHA, or None if the repository is inaccessible."""
     result = subprocess.run(
-        ["git", "ls-remote", repo_url],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
+        ["git", "ls-remote", repo_url, "HEAD"],
+        capture_output=True,
+        text=True,
     )
-    return result.returncode == 0
-
-def is_repo_accessible(repo_url):
-    """Check if the repository URL is accessible via HTTP."""
-    try:
-        response = requests.head(repo_url, timeout=5)
-        return response.status_code == 200
-    except requests.RequestException:
-        return False
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    return result.stdout.split()[0]
 
 def is_valid_filename(filename):
     """Check if the filename contains invalid characters."""
@@ -73,11 +79,15 @@ def rename_invalid_files(local_path):
                     print(f"Error renaming file {old_path}: {e}")
 
 def get_repo_path(repo_url):
-    """Extract the repository path from the URL."""
-    return repo_url.replace("https://github.com/", "")
+    """Extract the owner/repo path from the URL (or a local bare repository path)."""
+    owner, repo_name = repo_url.rstrip("/").split("/")[-2:]
+    return f"{owner}/{repo_name.removesuffix('.git')}"
 
 def clean_unused_repos():
-    """Remove directories not in the repos list or for inaccessible repositories."""
+    """Remove directories not in the repos list.
+
+    Checkouts of inaccessible repositories are removed by clone_or_update_repo.
+    """
     current_dir = os.getcwd()
     print(f"Current directory: {current_dir}")
 
@@ -101,30 +111,49 @@ def clean_unused_repos():
             shutil.rmtree(dir_path, ignore_errors=True)
             print(f"Removed directory not in repos list: {dir_path}")
 
-    for repo_url in repos:
-        repo_path = get_repo_path(repo_url)
-        local_path = os.path.join(current_dir, repo_path)
-        if os.path.exists(local_path):
-            if not is_repo_accessible(repo_url):
-                shutil.rmtree(local_path, ignore_errors=True)
-                print(f"Removed directory for inaccessible repository: {local_path}")
+def hash_files(local_path):
+    """Return {path: sha256} for every file of a checkout, paths relative to the current directory."""
+    hashes = {}
+    for root, dirs, files in os.walk(local_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            with open(file_path, "rb") as f:
+                hashes[os.path.relpath(file_path)] = hashlib.sha256(f.read()).hexdigest()
+    return hashes
+
+def diff_files(before, after):
+    """Paths added, modified or removed between two hash_files snapshots."""
+    return sorted(
+        path
+        for path in before.keys() | after.keys()
+        if before.get(path) != after.get(path)
+    )
 
-def clone_or_update_repo(repo_url):
-    """Clone or update a repository and process its files."""
+def clone_or_update_repo(repo_url, known_sha=None):
+    """Clone or update a repository and process its files.
+
+    Returns (status, sha, changed files), the checkout is left as is when
+    the remote HEAD is still known_sha.
+    """
     repo_path = get_repo_path(repo_url)
     owner, repo_name = repo_path.split("/")
     local_path = os.path.join(owner, repo_name)
 
-    if not os.path.exists(owner):
-        os.makedirs(owner)
+    os.makedirs(owner, exist_ok=True)
+
+    sha = get_remote_head(repo_url)
+    if sha is not None and sha == known_sha and os.path.exists(local_path):
+        print(f"Repository is up to date: {repo_url} ({sha[:7]})")
+        return "unchanged", sha, []
 
+    before = hash_files(local_path)
     if os.path.exists(local_path):
         shutil.rmtree(local_path)
         print(f"Removed old directory: {local_path}")
 
-    if not is_repo_public(repo_url):
+    if sha is None:
         print(f"Skipping private or inaccessible repository: {repo_url}")
-        return
+        return "skipped", None, diff_files(before, {})
 
     try:
         subprocess.run(
@@ -133,14 +162,67 @@ def clone_or_update_repo(repo_url):
             capture_output=True,
             text=True,
         )
+        # HEAD may have moved since ls-remote, record what was actually cloned
+        sha = subprocess.run(
+            ["git", "-C", local_path, "rev-parse", "HEAD"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
         shutil.rmtree(os.path.join(local_path, ".git"), ignore_errors=True)
         rename_invalid_files(local_path)
         print(f"Cloned and processed repository: {repo_url} -> {local_path}")
+        return "cloned", sha, diff_files(before, hash_files(local_path))
     except subprocess.CalledProcessError as e:
         print(f"Error cloning {repo_url}: {e.stderr}, skipping.")
+        return "skipped", None, diff_files(before, hash_files(local_path))
+
+def load_repos_lock(path=REPOS_LOCK_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def timed_clone(repo_url, known_sha=None):
+    started = time.perf_counter()
+    status, sha, changed = clone_or_update_repo(repo_url, known_sha)
+    return status, sha, changed, time.perf_counter() - started
+
+def sync_repos(repo_urls, workers=CLONE_WORKERS, incremental=True):
+    """Check and clone repositories concurrently.
+
+    Writes the remote HEADs to REPOS_LOCK_PATH and the files that changed to
+    CHANGED_FILES_PATH, returns {url: (status, sha, changed files, seconds)}.
+    """
+    started = time.perf_counter()
+    lock = load_repos_lock() if incremental else {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(timed_clone, url, lock.get(url)): url for url in repo_urls}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    for repo_url in repo_urls:
+        status, _, changed, seconds = results[repo_url]
+        print(f"{status:>10} {seconds:6.2f}s {len(changed):5} files changed {repo_url}")
+
+    synced = {url: result[1] for url, result in results.items() if result[1]}
+    changed = sorted(path for result in results.values() for path in result[2])
+    with open(REPOS_LOCK_PATH, "w", encoding="utf-8") as f:
+        json.dump({url: synced[url] for url in repo_urls if url in synced}, f, indent=2)
+    with open(CHANGED_FILES_PATH, "w", encoding="utf-8") as f:
+        json.dump(changed, f, ensure_ascii=False, indent=2)
+
+    cloned = sum(result[0] == "cloned" for result in results.values())
+    print(
+        f"Synced {len(synced)}/{len(repo_urls)} repositories ({cloned} cloned, "
+        f"{len(synced) - cloned} unchanged), {len(changed)} files changed "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    return results
 
 if __name__ == "__main__":
     configure_git()  # Set Git configuration at the start
     clean_unused_repos()
-    for repo_url in repos:
-        clone_or_update_repo(repo_url)
\ No newline at end of file
+    sync_repos(repos)
\ No newline at end of file
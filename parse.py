@@ -1,169 +1,413 @@
+import io
 import os
 import ast
 import json
+import time
+import hashlib
+import argparse
 
-from clone_repos import repos
-from typing import Dict
+from concurrent.futures import ProcessPoolExecutor
+from clone_repos import repos, CHANGED_FILES_PATH
+from catalog import write_catalog
+from typing import Dict, List, Optional
 
+SKIP_DIRS = {"venv", "__pycache__"}
+# Скрипты пайплайна в корне репозитория - не модули, хотя в них есть
+# классы с "Mod" в имени и все имена из RISK_CHECKS
+PIPELINE_SCRIPTS = {
+    "parse.py",
+    "catalog.py",
+    "categories.py",
+    "build_index.py",
+    "clone_repos.py",
+    "bench_catalog.py",
+    "bench_search.py",
+}
 
-def get_module_info(module_path):
+# Увеличивать при любом изменении результата get_module_info,
+# иначе кэш отдаст записи старого формата
+PARSER_VERSION = 5
+PARSE_CACHE_PATH = ".parse_cache.json"
+
+# Проверки из vsecoder/hikka_modules/CheckMods.py: уровень -> {имя: что даёт модулю}
+RISK_CHECKS = {
+    "critical": {
+        "DeleteAccountRequest": "delete account",
+        "edit_2fa": "change 2FA password",
+        "get_me": "presumably get your profile account data",
+        "disconnect": "disconnect account",
+        "log_out": "disconnect account",
+        "ResetAuthorizationRequest": "kill account sessions",
+        "GetAuthorizationsRequest": "get telegram api_id and api_hash",
+        "AddRequest": "get telegram api_id and api_hash",
+        "pyarmor": "all(obfuscated script)",
+        "pyrogram": "another tg client",
+        "system": "presumably eval commands",
+        "eval": "presumably eval python code",
+        "exec": "presumably exec python code",
+        "sessions": "get all sessions data, delete sessoins, copy and send sessions",
+        "subprocess": "eval commands",
+        "torpy": "download viruses",
+        "httpimport": "import malicious scripts",
+    },
+    "warn": {
+        "list_sessions": "get all account sessions",
+        "LeaveChannelRequest": "leave channel and chats",
+        "JoinChannelRequest": "join channel and chats",
+        "ChannelAdminRights": "edit channel and chats users perms",
+        "EditBannedRequest": "kick and ban users",
+        "remove": "presumably remove files",
+        "rmdir": "presumably remove dirs",
+        "telethon": "telethon funcs",
+        "get_response": "get telegram messages",
+    },
+    "council": {
+        "requests": "send requests",
+        "get_entity": "get entities",
+        "get_dialogs": "get dialogs",
+        "os": "presumably get os info",
+        "sys": "presumably get sys info",
+        "import": "import modules",
+        "client": "all client functions",
+        "send_message": "send messages",
+        "send_file": "send files",
+        "TelegramClient": "create new session",
+        "download_file": "download telegram files",
+        "ModuleConfig": "create configs",
+    },
+}
+RISK_NAMES = {name for checks in RISK_CHECKS.values() for name in checks}
+
+
+def get_decorator_name(decorator) -> str:
+    """Имя декоратора без аргументов: loader.command(...) -> loader.command."""
+    if isinstance(decorator, ast.Call):
+        decorator = decorator.func
+    parts = []
+    while isinstance(decorator, ast.Attribute):
+        parts.append(decorator.attr)
+        decorator = decorator.value
+    if isinstance(decorator, ast.Name):
+        parts.append(decorator.id)
+    return ".".join(reversed(parts))
+
+
+def extract_loader_command_args(decorator):
+    """Извлекает аргументы `ru_doc` и `en_doc` из `@loader.command`."""
+    if (
+        isinstance(decorator, ast.Call)
+        and hasattr(decorator.func, "attr")
+        and decorator.func.attr == "command"
+    ):
+        ru_doc = None
+        en_doc = None
+        for keyword in decorator.keywords:
+            if keyword.arg == "ru_doc":
+                ru_doc = ast.literal_eval(keyword.value)
+            elif keyword.arg == "en_doc":
+                en_doc = ast.literal_eval(keyword.value)
+        return ru_doc, en_doc
+    return None, None
+
+
+class TopLevelVisitor(ast.NodeVisitor):
+    """Один проход по верхнему уровню модуля: класс модуля и __version__.
+
+    В тела функций и вложенные классы не спускается, декораторы
+    сравниваются по именам без ast.unparse.
+    """
+
+    def __init__(self, meta_info):
+        self.meta_info = meta_info
+        self.module = {}
+        self.version = None
+
+    def visit_Module(self, node):
+        for child in node.body:
+            if isinstance(child, (ast.ClassDef, ast.Assign)):
+                self.visit(child)
+
+    def visit_Assign(self, node):
+        if not any(isinstance(target, ast.Name) and target.id == "__version__" for target in node.targets):
+            return
+        try:
+            version = ast.literal_eval(node.value)
+        except ValueError:
+            return
+        if isinstance(version, tuple):
+            version = ".".join(map(str, version))
+        if isinstance(version, str):
+            self.version = version
+
+    def visit_ClassDef(self, node):
+        is_tds_mod = any(get_decorator_name(d).endswith("loader.tds") for d in node.decorator_list)
+        if "Mod" not in node.name and not is_tds_mod:
+            return
+
+        class_info = {
+            "name": node.name,
+            "description": ast.get_docstring(node),
+            "meta": self.meta_info,
+            "commands": [],
+            "new_commands": [],
+        }
+
+        for class_body_node in node.body:
+            if not isinstance(class_body_node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                continue
+            is_loader_command = any(
+                "command" in get_decorator_name(d) for d in class_body_node.decorator_list
+            )
+            if not is_loader_command and "cmd" not in class_body_node.name:
+                continue
+
+            method_docstring = ast.get_docstring(class_body_node)
+            command_name = class_body_node.name
+            ru_doc, en_doc = None, None
+
+            for decorator in class_body_node.decorator_list:
+                ru_doc_tmp, en_doc_tmp = extract_loader_command_args(decorator)
+                if ru_doc_tmp:
+                    ru_doc = ru_doc_tmp
+                if en_doc_tmp:
+                    en_doc = en_doc_tmp
+
+            descriptions = [doc for doc in (method_docstring, ru_doc, en_doc) if doc]
+            class_info["commands"].append({command_name: " ".join(descriptions)})
+            class_info["new_commands"].append(
+                {
+                    command_name.replace("cmd", ""): {
+                        "ru_doc": ru_doc,
+                        "en_doc": en_doc,
+                        "doc": method_docstring,
+                    }
+                }
+            )
+
+        # Если классов модуля несколько, берётся последний
+        self.module = class_info
+
+
+def code_names(tree) -> set:
+    """Имена из кода модуля: переменные, атрибуты, импорты, функции и аргументы.
+
+    Комментарии, докстринги и строки сюда не попадают: слово "sessions"
+    в описании модуля не считается вызовом.
+    """
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.add("import")
+            if isinstance(node, ast.ImportFrom) and node.module:
+                names.update(node.module.split("."))
+            for alias in node.names:
+                names.update(alias.name.split("."))
+                if alias.asname:
+                    names.add(alias.asname)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.keyword) and node.arg:
+            names.add(node.arg)
+    return names
+
+
+def scan_risks(tree) -> Dict[str, list]:
+    """Профиль риска модуля: найденные проверки RISK_CHECKS по уровням."""
+    found = RISK_NAMES.intersection(code_names(tree))
+    return {
+        level: [name for name in checks if name in found]
+        for level, checks in RISK_CHECKS.items()
+    }
+
+
+def get_module_info(module_path, source=None):
     """Парсит Python-модуль и извлекает информацию о нем."""
-    with open(module_path, "r", encoding="utf-8") as f:
-        module_content = f.read()
+    if source is None:
+        with open(module_path, "rb") as f:
+            source = f.read()
+    # Декодируем так же, как open(..., "r"), включая перевод строк
+    module_content = io.TextIOWrapper(io.BytesIO(source), encoding="utf-8").read()
 
     meta_info = {"pic": None, "banner": None}
+    requires = []
     for line in module_content.split("\n"):
+        if not line.startswith("# "):
+            continue
         if line.startswith("# meta"):
-            key, value = line.replace("# meta ", "").split(": ")
+            key, value = line.replace("# meta ", "").split(": ", 1)
             meta_info[key] = value
+        elif line.startswith("# requires:"):
+            requires.extend(line[len("# requires:"):].split())
 
     tree = ast.parse(module_content)
+    extractor = TopLevelVisitor(meta_info)
+    extractor.visit(tree)
+    if not extractor.module:
+        return {}
 
-    def get_decorator_names(decorator_list):
-        return [ast.unparse(decorator) for decorator in decorator_list]
-
-    def extract_loader_command_args(decorator):
-        """Извлекает аргументы `ru_doc` и `en_doc` из `@loader.command`."""
-        if (
-            isinstance(decorator, ast.Call)
-            and hasattr(decorator.func, "attr")
-            and decorator.func.attr == "command"
-        ):
-            ru_doc = None
-            en_doc = None
-            for keyword in decorator.keywords:
-                if keyword.arg == "ru_doc":
-                    ru_doc = ast.literal_eval(keyword.value)
-                elif keyword.arg == "en_doc":
-                    en_doc = ast.literal_eval(keyword.value)
-            return ru_doc, en_doc
-        return None, None
-
-    result = {}
-    for node in ast.walk(tree):
-        if isinstance(node, ast.ClassDef):
-            decorators = get_decorator_names(node.decorator_list)
-            is_tds_mod = [d for d in decorators if "loader.tds" in d]
-            if "Mod" not in node.name and not is_tds_mod:
-                continue
-
-            class_docstring = ast.get_docstring(node)
-            class_info = {
-                "name": node.name,
-                "description": class_docstring,
-                "meta": meta_info,
-                "commands": [],
-                "new_commands": [],
-            }
-
-            for class_body_node in node.body:
-                if isinstance(class_body_node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                    decorators = get_decorator_names(class_body_node.decorator_list)
-                    is_loader_command = [d for d in decorators if "command" in d]
-                    if not is_loader_command and "cmd" not in class_body_node.name:
-                        continue
-
-                    method_docstring = ast.get_docstring(class_body_node)
-                    command_name = class_body_node.name
-                    ru_doc, en_doc = None, None
-
-                    for decorator in class_body_node.decorator_list:
-                        ru_doc_tmp, en_doc_tmp = extract_loader_command_args(decorator)
-                        if ru_doc_tmp:
-                            ru_doc = ru_doc_tmp
-                        if en_doc_tmp:
-                            en_doc = en_doc_tmp
-
-                    descriptions = []
-                    if method_docstring:
-                        descriptions.append(method_docstring)
-                    if ru_doc:
-                        descriptions.append(ru_doc)
-                    if en_doc:
-                        descriptions.append(en_doc)
-
-                    class_info["commands"].append(
-                        {command_name: ' '.join(descriptions)}
-                    )
-
-                    command_name = command_name.replace('cmd', '')
-
-                    class_info["new_commands"].append(
-                        {
-                            command_name: {
-                                "ru_doc": ru_doc,
-                                "en_doc": en_doc,
-                                "doc": method_docstring,
-                            }
-                        }
-                    )
-
-            result = class_info
-
-    return result
-
-def parse_developers(base_dir: str) -> Dict[str, list]:
-    developers = {
-        "repo": set(),  # используем set внутри функции
-        "channel": set()
+    return {
+        **extractor.module,
+        "requires": requires,
+        "version": extractor.version,
+        "risk": scan_risks(tree),
     }
-    
+
+def get_developer_channels(module_info) -> list:
+    """Извлекает каналы разработчиков (@...) из meta developer."""
+    developer = module_info.get("meta", {}).get("developer")
+    if not developer:
+        return []
+    # Разделяем строки с запятыми, &, | и пробелами, оставляем только @...
+    return [
+        dev.strip()
+        for dev in developer.replace(',', ' ').replace('&', ' ').replace('|', ' ').split()
+        if dev.startswith('@')
+    ]
+
+
+def parse_file(file_path: str, source: bytes) -> dict:
+    """Парсит уже прочитанный файл: запись модуля и каналы разработчиков."""
+    try:
+        module_info = get_module_info(file_path, source)
+    except Exception as e:
+        return {"module": None, "channels": [], "error": f"Ошибка при парсинге файла {file_path}: {e}"}
+    if not module_info:
+        return {"module": None, "channels": [], "error": None}
+    return {"module": module_info, "channels": get_developer_channels(module_info), "error": None}
+
+
+def load_parse_cache(path: str = PARSE_CACHE_PATH) -> dict:
+    """Кэш {относительный путь: {sha256, module, channels, error}} прошлых запусков."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("version") != PARSER_VERSION:
+        return {}
+    return cache["files"]
+
+
+def save_parse_cache(files: dict, path: str = PARSE_CACHE_PATH):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": PARSER_VERSION, "files": files}, f, ensure_ascii=False)
+
+
+def find_module_files(base_dir: str) -> List[str]:
+    files = []
+    for root, dirs, filenames in os.walk(base_dir):
+        # venv создаётся CI прямо в рабочей копии
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d not in SKIP_DIRS]
+        files.extend(
+            os.path.join(root, file)
+            for file in filenames
+            if file.endswith(".py") and not (root == base_dir and file in PIPELINE_SCRIPTS)
+        )
+    return sorted(files)
+
+
+def parse_modules(base_dir: str, workers: Optional[int] = None, changed: Optional[set] = None):
+    """Параллельно парсит изменившиеся модули, остальные берёт из кэша.
+
+    changed - пути, изменённые с прошлого запуска (см. clone_repos.py):
+    остальные файлы из кэша даже не читаются и не хэшируются.
+    Результат не зависит от порядка выполнения.
+    """
+    cache = load_parse_cache()
+    entries = {}
+    pending = []
+    for file_path in find_module_files(base_dir):
+        relative_path = os.path.relpath(file_path, base_dir)
+        if changed is not None and relative_path not in changed and relative_path in cache:
+            entries[relative_path] = cache[relative_path]
+            continue
+
+        with open(file_path, "rb") as f:
+            source = f.read()
+        sha256 = hashlib.sha256(source).hexdigest()
+
+        cached = cache.get(relative_path)
+        if cached and cached["sha256"] == sha256:
+            entries[relative_path] = cached
+        else:
+            pending.append((relative_path, file_path, source, sha256))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                parse_file,
+                [file_path for _, file_path, _, _ in pending],
+                [source for _, _, source, _ in pending],
+                chunksize=8,
+            )
+            for (relative_path, _, _, sha256), result in zip(pending, results):
+                entries[relative_path] = {"sha256": sha256, **result}
+
+    save_parse_cache(entries)
+
+    modules_data = {}
+    channels = set()
+    for relative_path in sorted(entries):
+        entry = entries[relative_path]
+        if entry["error"]:
+            print(entry["error"])
+        if entry["module"]:
+            modules_data[relative_path] = entry["module"]
+            channels.update(entry["channels"])
+    return modules_data, channels, len(entries), len(pending)
+
+
+def parse_developers(channels) -> Dict[str, list]:
+    owners = set()
     for repo_url in repos:
         repo_path = repo_url.replace("https://github.com/", "")
         try:
             owner, repo_name = repo_path.split("/")
-            developers["repo"].add(owner)
+            owners.add(owner)
         except ValueError:
             print(f"Incorrect URL of repository: {repo_url}")
             continue
 
-    for root, _, files in os.walk(base_dir):
-        for file in files:
-            if file.endswith(".py"):
-                file_path = os.path.join(root, file)
-                try:
-                    module_info = get_module_info(file_path)
-                    if module_info and "meta" in module_info:
-                        developer = module_info["meta"].get('developer')
-                        if developer:  # Проверяем, что developer не None
-                            # Разделяем строки с запятыми, &, | и пробелами
-                            for dev in developer.replace(',', ' ').replace('&', ' ').replace('|', ' ').split():
-                                # Добавляем только элементы, начинающиеся с @
-                                if dev.startswith('@'):
-                                    developers["channel"].add(dev.strip())
-                except Exception as e:
-                    print(f"Ошибка при парсинге файла {file_path}: {e}")
-
-    # Преобразуем set в list перед возвратом
     return {
-        "repo": list(developers["repo"]),
-        "channel": list(developers["channel"])
+        "repo": sorted(owners),
+        "channel": sorted(channels)
     }
 
 
-modules_data = {}
-base_dir = os.getcwd()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--changed",
+        action="store_true",
+        help=f"читать только файлы из {CHANGED_FILES_PATH}, остальные брать из кэша",
+    )
+    args = parser.parse_args()
+    base_dir = os.getcwd()
 
-for root, _, files in os.walk(base_dir):
-    for file in files:
-        if file.endswith(".py"):
-            file_path = os.path.join(root, file)
-            try:
-                module_info = get_module_info(file_path)
-                if module_info:
-                    relative_path = os.path.relpath(file_path, base_dir)
-                    modules_data[relative_path] = module_info
-            except Exception as e:
-                print(f"Ошибка при парсинге файла {file_path}: {e}")
+    changed = None
+    if args.changed:
+        with open(CHANGED_FILES_PATH, "r", encoding="utf-8") as f:
+            changed = set(json.load(f))
 
-developers = parse_developers(base_dir)
+    started = time.perf_counter()
+    modules_data, channels, files_count, parsed_count = parse_modules(base_dir, changed=changed)
+    developers = parse_developers(channels)
+    print(
+        f"Обработано {files_count} файлов ({parsed_count} разобрано, "
+        f"{files_count - parsed_count} из кэша) за {time.perf_counter() - started:.2f}с"
+    )
 
-with open("modules.json", "w", encoding="utf-8") as json_file:
-   json.dump(modules_data, json_file, ensure_ascii=False, indent=2)
+    write_catalog(modules_data)
 
-print("Файл modules.json создан!")
+    print("Файл modules.json создан!")
 
-with open("developers.json", "w", encoding="utf-8") as json_file:
-   json.dump(developers, json_file, ensure_ascii=False, indent=2)
+    with open("developers.json", "w", encoding="utf-8") as json_file:
+        json.dump(developers, json_file, ensure_ascii=False, indent=2)
 
-print("Файл developers.json создан!")
\ No newline at end of file
+    print("Файл developers.json создан!")